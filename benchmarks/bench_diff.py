@@ -0,0 +1,82 @@
+"""
+scaling of the diff engine, a large checkout appears between two snapshots
+
+usage: python benchmarks/bench_diff.py [max number of pathnames]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, os.pardir, os.pardir)))
+
+from generic.diff import ADDED, REMOVED, MODIFIED, iter_changes
+from generic.snapshot import Snapshot
+
+QUADRATIC_LIMIT = 20000  # the list-based diff takes too long above it
+
+
+def list_diff(before, after):
+    # the former MonitorBase.iter_diff
+    events = {
+        ADDED: [f for f in after if f not in before],
+        REMOVED: [f for f in before if f not in after],
+    }
+    events[MODIFIED] = [
+        f for f, mtime in after.items() if f not in events[ADDED] and mtime != before[f]
+    ]
+    return events
+
+
+def make_status(count):
+    """
+    10% of the pathnames are removed, 10% modified and 20% are a new checkout
+    """
+    before = {}
+    after = {}
+    for index in range(count):
+        pathname = "rtl/block_%03d/unit_%03d/file_%07d.sv" % (
+            index // 10000,
+            index // 100 % 100,
+            index,
+        )
+        before[pathname] = (index, 100)
+        if index % 10 == 0:
+            continue
+        after[pathname] = (index + 1, 100) if index % 10 == 1 else (index, 100)
+    for index in range(count // 5):
+        after["checkout/new_%07d.sv" % index] = (index, 100)
+    return before, after
+
+
+def timeit(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main(limit):
+    print(
+        "%10s %14s %14s %14s" % ("entries", "list diff", "dict diff", "Snapshot diff")
+    )
+    count = 1000
+    while count <= limit:
+        before, after = make_status(count)
+        old = Snapshot.from_items(before.items())
+        new = Snapshot.from_items(after.items())
+
+        if count <= QUADRATIC_LIMIT:
+            list_time = "%12.3fs" % timeit(lambda: list_diff(before, after))
+        else:
+            list_time = "%13s" % "skipped"
+        dict_time = timeit(lambda: list(iter_changes(before, after)))
+        snapshot_time = timeit(lambda: list(iter_changes(old, new)))
+        print(
+            "%10s %14s %13.3fs %13.3fs" % (count, list_time, dict_time, snapshot_time)
+        )
+        count *= 10
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,56 @@
+"""
+scan time of FileMonitor on a simulated network filesystem, every stat and
+listing is delayed by the given latency
+
+usage: python benchmarks/bench_scan.py [latency in ms] [number of files]
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, os.pardir, os.pardir)))
+
+from generic import scan
+from monitors import FileMonitor
+
+
+def make_tree(root, count):
+    for index in range(count):
+        dirname = os.path.join(root, "block_%02d" % (index // 100))
+        if not os.path.isdir(dirname):
+            os.mkdir(dirname)
+        open(os.path.join(dirname, "file_%05d.sv" % index), "w").close()
+
+
+def main(latency, count):
+    root = tempfile.mkdtemp(prefix="bench_scan_")
+    try:
+        make_tree(root, count)
+        pattern = os.path.join(root, "**")
+        golden = None
+        print("%12s %10s" % ("concurrency", "get_status"))
+        for concurrency in (1, 4, 16, 64):
+            monitor = FileMonitor("@hourly", pattern, concurrency=concurrency)
+            scan.STAT_LATENCY = latency
+            start = time.time()
+            status = monitor.get_status()
+            elapsed = time.time() - start
+            scan.STAT_LATENCY = 0
+
+            assert golden is None or status == golden
+            golden = status
+            print("%12s %9.3fs" % (concurrency, elapsed))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    scan.SCAN_THREADS = 64
+    main(
+        float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.002,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+    )
@@ -0,0 +1,65 @@
+"""
+memory of a dict snapshot against generic.snapshot.Snapshot
+
+usage: python benchmarks/bench_snapshot.py [number of pathnames]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, os.pardir, os.pardir)))
+
+from generic.snapshot import Snapshot
+
+
+def iter_pathnames(count):
+    # a source tree like layout: 100 files per directory, 4 levels deep
+    for index in range(count):
+        dirname = "project/rtl/block_%03d/unit_%03d/sub_%02d" % (
+            index // 100000,
+            index // 1000 % 100,
+            index // 100 % 10,
+        )
+        yield "%s/module_%07d.sv" % (dirname, index)
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.time()
+    snapshot = build()
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return snapshot, current, peak, elapsed
+
+
+def main(count):
+    mtime_ns = int(time.time() * 1e9)
+
+    def build_dict():
+        return dict(
+            (pathname, float(index))
+            for index, pathname in enumerate(iter_pathnames(count))
+        )
+
+    def build_snapshot():
+        return Snapshot.from_items(
+            (pathname, (mtime_ns + index, index))
+            for index, pathname in enumerate(iter_pathnames(count))
+        )
+
+    print("%s pathnames" % count)
+    for name, build in (("dict", build_dict), ("Snapshot", build_snapshot)):
+        snapshot, current, peak, elapsed = measure(build)
+        print(
+            "%-10s retained %8.1f MB  peak %8.1f MB  build %6.2f s"
+            % (name, current / 1e6, peak / 1e6, elapsed)
+        )
+        del snapshot
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -53,6 +53,9 @@ class CallBack:
 
     logger = LOGGER
 
+    # factory with the subprocess.Popen signature, a runtime may replace it per callback
+    popen = subprocess.Popen
+
     def __init__(self, name, cmd, env=None, **kwargs):
         self.name = name
         self.worker = None
@@ -103,7 +106,7 @@ class CallBack:
         # )
 
         # try:
-        self.worker = subprocess.Popen(
+        self.worker = self.popen(
             self._cmd,
             env=self.env,
             stdout=self.stdout_tmpfile,
@@ -328,6 +331,14 @@ class EventManger:
         for pool in self.events.values():
             pool.kill()
 
+    def iter_callbacks(self):
+        """
+        iterate over callbacks of all events, error and success handlers are excluded
+        """
+        for pool in self.events.values():
+            for callback in pool.pool:
+                yield callback
+
     def add_event(self, event_name, callbacks, config, continue_on_error=False):
 
         callback_pool = CallBackPool(gen_hier(self.name, event_name), continue_on_error)
@@ -3,10 +3,11 @@ import datetime
 import logging
 import fnmatch
 import os
-import re
 import itertools
 import glob
 from .filelist_reader import iter_filelist_reader
+from .scan import walk
+from .pattern import has_magic, compile_pattern
 
 indent = "    "
 
@@ -38,43 +39,61 @@ def filelist_reader(filelist):
     return list(iter_filelist_reader(filelist))
 
 
-def _iglobstar(dirname, basename):
+def _iglobstar(dirname, basename, cache=None, deps=None, prune=None, concurrency=1):
     try:
         if os.path.isdir(dirname):
             yield dirname
-        for root, dirs, files in os.walk(dirname):
-            dirs[:] = [d for d in dirs if d[0] != "."]
+        if prune is not None and prune(dirname):
+            return
+        for root, dirs, files in walk(dirname, cache, prune, concurrency):
+            if deps is not None:
+                deps.add(root)
             for f in itertools.chain(dirs, files):
-                if f[0] != ".":
-                    yield os.path.join(root, f)
+                yield f
     except os.error:
         pass
 
 
-def _glob1(dirname, basename):
-    pattern = "{(\S+)}"
-    pattern = re.compile(pattern)
-    basenames = pattern.split(basename)
-    acc = [""]
-    for base in basenames:
-        _acc = []
-        for ext in base.split(","):
-            _acc.extend([f + ext for f in acc])
-        acc = _acc
-
-    for basename in acc:
-        for name in glob.glob1(dirname, basename):
+def _glob1(dirname, basename, cache=None):
+    """
+    match all alternatives of the braces against a single listing of dirname
+    """
+    match = compile_pattern(basename).match
+    try:
+        if cache is None or basename.startswith("."):
+            names = os.listdir(dirname)
+        else:
+            names = cache.listdir(dirname).names
+    except os.error:
+        return
+    if not basename.startswith("."):
+        names = [name for name in names if not name.startswith(".")]
+    for name in names:
+        if match(name):
             yield name
 
 
-def iglob(pathname, yield_even_not_exists=False):
+def iglob(
+    pathname,
+    yield_even_not_exists=False,
+    cache=None,
+    deps=None,
+    prune=None,
+    concurrency=1,
+):
+    """
+    cache: a generic.scan.DirCache or ListingMemo to reuse listings of directories
+    deps: a generic.scan.Dependencies which records every directory that was looked up
+    prune: a function of a directory, nothing under it is yielded if it returns True
+    concurrency: directories under "**" are listed on up to concurrency threads
+    """
 
     pathname = os.path.expandvars(pathname)
     dirname, basename = os.path.split(pathname)
 
     assert dirname != pathname, pathname
 
-    if not glob.has_magic(pathname):
+    if not has_magic(pathname):
         if yield_even_not_exists:
             yield pathname
         elif basename:
@@ -88,22 +107,36 @@ def iglob(pathname, yield_even_not_exists=False):
     if dirname == "":
         dirname = os.curdir
 
-    if glob.has_magic(dirname):
-        dirs = set(iglob(dirname))
+    if has_magic(dirname):
+        dirs = set(
+            iglob(dirname, cache=cache, deps=deps, prune=prune, concurrency=concurrency)
+        )
     else:
         dirs = [dirname]
 
     if basename == "**":
         glob_in_dir = _iglobstar
-    elif glob.has_magic(basename):
+    elif has_magic(basename):
         glob_in_dir = _glob1
     else:
         glob_in_dir = glob.glob0
 
     for dirname in dirs:
-        for name in glob_in_dir(dirname, basename):
-            if glob_in_dir is _iglobstar:
-                f = name
-            else:
-                f = os.path.join(dirname, name)
-            yield f
+        if glob_in_dir is _iglobstar:
+            if deps is not None:
+                deps.add(dirname)
+            for f in _iglobstar(dirname, basename, cache, deps, prune, concurrency):
+                yield f
+            continue
+
+        if prune is not None and prune(dirname):
+            continue
+        if deps is not None:
+            deps.add(dirname)
+
+        if glob_in_dir is _glob1:
+            names = _glob1(dirname, basename, cache)
+        else:
+            names = glob_in_dir(dirname, basename)
+        for name in names:
+            yield os.path.join(dirname, name)
@@ -0,0 +1,69 @@
+"""
+diff two snapshots of pathname -> value in linear time
+"""
+
+from .snapshot import Snapshot, decode
+
+MODIFIED = "modified"
+REMOVED = "removed"
+ADDED = "added"
+
+MISSING = -1  # value reported for the side where the pathname doesn't exist
+
+_missing = object()
+
+
+def _merge(before, after):
+    # both are sorted, so one merge pass over the encoded pathnames is enough
+    before_items = before.iter_raw()
+    after_items = after.iter_raw()
+    old = next(before_items, None)
+    new = next(after_items, None)
+
+    while old is not None and new is not None:
+        if old[0] == new[0]:
+            if old[1] != new[1]:
+                yield MODIFIED, decode(new[0]), old[1], new[1]
+            old = next(before_items, None)
+            new = next(after_items, None)
+        elif old[0] < new[0]:
+            yield REMOVED, decode(old[0]), old[1], MISSING
+            old = next(before_items, None)
+        else:
+            yield ADDED, decode(new[0]), MISSING, new[1]
+            new = next(after_items, None)
+
+    while old is not None:
+        yield REMOVED, decode(old[0]), old[1], MISSING
+        old = next(before_items, None)
+
+    while new is not None:
+        yield ADDED, decode(new[0]), MISSING, new[1]
+        new = next(after_items, None)
+
+
+def iter_changes(before, after):
+    """
+    yield (event, pathname, before value, after value) for every change
+
+    Snapshots are merged in sorted order, other mappings are compared with one
+    hash lookup per pathname. Either way it's one pass over each side.
+    """
+    if before is after:
+        return
+
+    if isinstance(before, Snapshot) and isinstance(after, Snapshot):
+        for change in _merge(before, after):
+            yield change
+        return
+
+    for pathname, value in after.items():
+        old = before.get(pathname, _missing)
+        if old is _missing:
+            yield ADDED, pathname, MISSING, value
+        elif old != value:
+            yield MODIFIED, pathname, old, value
+
+    for pathname, value in before.items():
+        if pathname not in after:
+            yield REMOVED, pathname, value, MISSING
@@ -1,51 +1,50 @@
 import os
 import re
 
+from . import scan
+
 
 OPTION_PREFIX = "+-"
 filelist_pattern = re.compile(r"\s*(-f|-F)?\s*(\S+)")
+variable_pattern = re.compile(r"\$(\w+|\{[^}]*\})")
 
+# entries of a parsed filelist
+FILE = 0  # (FILE, pathname)
+INCLUDE = 1  # (INCLUDE, filelist, line number)
 
-def iter_filelist_reader(filelist, _scope=0, parent=None, line_count=None):
-
-    match = filelist_pattern.match(filelist)
-    if not match:
-        raise ValueError("input filelist format incorrect")
-    filelist = match.group(2)
 
-    if not os.path.exists(filelist):
-        loc = " at line %s in %s" % (line_count, parent) if parent else ""
-        raise OSError("The file '%s' does not exist%s" % (filelist, loc))
+def parse_filelist(filelist, variables=None):
+    """
+    return the entries of a single filelist, included filelists are not read
 
-    yield filelist
-    line_count = 0
+    variables: a set which the names of the expanded environment variables are added to
+    """
+    entries = []
+    append = entries.append
+    expandvars = os.path.expandvars
 
     with open(filelist, "r") as fo:
-        for line in fo.readlines():
-            line_count += 1
-            line = re.sub(
-                r"//.*", "", line
-            ).strip()  # remove comments and space between
+        for line_count, line in enumerate(fo, 1):
+            # remove comments and space between
+            tokens = line.split("//", 1)[0].split()
             preceding_token = None
-            if not line:
-                continue
-            tokens = re.split(r"\s*", line)
 
             for token in tokens:
-                token = os.path.expandvars(token)
-                if not token:
-                    continue
+                if "$" in token:
+                    if variables is not None:
+                        for name in variable_pattern.findall(token):
+                            variables.add(name.strip("{}"))
+                    token = expandvars(token)
+                    if not token:
+                        continue
 
                 if preceding_token:
                     # mean current token could be option value
                     if preceding_token == "-f" or preceding_token == "-F":
-                        for item in iter_filelist_reader(
-                            token, _scope + 1, filelist, line_count
-                        ):
-                            yield item
+                        append((INCLUDE, token, line_count))
 
                     elif token[0] not in OPTION_PREFIX:
-                        yield token
+                        append((FILE, token))
 
                     preceding_token = None
 
@@ -54,9 +53,86 @@ def iter_filelist_reader(filelist, _scope=0, parent=None, line_count=None):
                     preceding_token = token
 
                 elif token.startswith("+incdir"):
-                    token = token.split("+")
-                    for dir in token[2:]:
+                    for dir in token.split("+")[2:]:
                         if dir:
-                            yield dir
+                            append((FILE, dir))
+
                 elif token[0] not in OPTION_PREFIX:
-                    yield token
+                    append((FILE, token))
+
+    return entries
+
+
+class FilelistCache(object):
+    """
+    parsed entries of each filelist, reused while its mtime and size and the values of
+    the environment variables it expands are unchanged
+    """
+
+    def __init__(self):
+        self.entries = {}  # filelist -> ((mtime_ns, size), {variable: value}, entries)
+
+    def get(self, filelist):
+        st = os.stat(filelist)
+        key = (scan.get_mtime_ns(st), st.st_size)
+        cached = self.entries.get(filelist)
+        if cached is not None and cached[0] == key:
+            if all(os.environ.get(name) == value for name, value in cached[1].items()):
+                return cached[2]
+
+        variables = set()
+        entries = parse_filelist(filelist, variables)
+        if not scan.is_racy(key[0]):
+            env = dict((name, os.environ.get(name)) for name in variables)
+            self.entries[filelist] = (key, env, entries)
+        return entries
+
+
+filelist_cache = FilelistCache()
+
+
+def iter_filelist_reader(
+    filelist, _scope=0, parent=None, line_count=None, deps=None, cache=None, _stack=None
+):
+    """
+    deps: a generic.scan.Dependencies which records every filelist that was read
+    cache: a FilelistCache, shared by the whole process by default
+    """
+
+    match = filelist_pattern.match(filelist)
+    if not match:
+        raise ValueError("input filelist format incorrect")
+    filelist = match.group(2)
+
+    loc = " at line %s in %s" % (line_count, parent) if parent else ""
+    if not os.path.exists(filelist):
+        raise OSError("The file '%s' does not exist%s" % (filelist, loc))
+
+    if cache is None:
+        cache = filelist_cache
+    if _stack is None:
+        _stack = []
+
+    realpath = os.path.realpath(filelist)
+    if realpath in _stack:
+        cycle = _stack[_stack.index(realpath) :] + [realpath]
+        raise ValueError("Include cycle: %s%s" % (" -> ".join(cycle), loc))
+
+    yield filelist
+
+    if deps is not None:
+        deps.add(filelist)
+
+    _stack.append(realpath)
+    try:
+        for entry in cache.get(filelist):
+            if entry[0] == FILE:
+                yield entry[1]
+                continue
+
+            for item in iter_filelist_reader(
+                entry[1], _scope + 1, filelist, entry[2], deps, cache, _stack
+            ):
+                yield item
+    finally:
+        _stack.pop()
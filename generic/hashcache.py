@@ -0,0 +1,108 @@
+"""
+persistent cache of file digests keyed on (device, inode, size, mtime_ns)
+"""
+
+import array
+import hashlib
+import os
+import struct
+import tempfile
+
+from .snapshot import INT64, _tobytes
+
+BLOCK_SIZE = 1 << 20
+RECORD = 5  # int64 values of a saved digest and its key
+
+if hasattr(hashlib, "blake2b"):
+
+    def new_hash():
+        return hashlib.blake2b(digest_size=8)
+
+else:  # python 2
+
+    def new_hash():
+        return hashlib.sha1()
+
+
+def hash_file(pathname):
+    """
+    return the digest of the content as a 64-bit integer
+    """
+    h = new_hash()
+    with open(pathname, "rb") as fo:
+        while True:
+            block = fo.read(BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return struct.unpack("<q", h.digest()[:8])[0]
+
+
+class HashCache(object):
+    """
+    a file is only hashed again when its device, inode, size or mtime changes
+
+    the cache is saved as an array of (device, inode, size, mtime_ns, digest), keys
+    which weren't used since the last prune are dropped.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.digests = {}  # (device, inode, size, mtime_ns) -> digest
+        self.used = set()
+        self.dirty = False
+        if filename and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        values = array.array(INT64)
+        with open(self.filename, "rb") as fo:
+            data = fo.read()
+        if len(data) % (RECORD * values.itemsize):
+            return  # truncated or written by an incompatible platform
+        if hasattr(values, "frombytes"):
+            values.frombytes(data)
+        else:
+            values.fromstring(data)
+        for index in range(0, len(values), RECORD):
+            key = tuple(values[index : index + RECORD - 1])
+            self.digests[key] = values[index + RECORD - 1]
+
+    def save(self):
+        if not self.filename or not self.dirty:
+            return
+        values = array.array(INT64)
+        for key, digest in self.digests.items():
+            values.extend(key)
+            values.append(digest)
+
+        dirname = os.path.dirname(self.filename) or os.curdir
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".hashes_")
+        try:
+            with os.fdopen(fd, "wb") as fo:
+                fo.write(_tobytes(values))
+            os.rename(tmpname, self.filename)
+        except Exception:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+        self.dirty = False
+
+    def digest(self, pathname, device, inode, size, mtime_ns):
+        key = (device, inode, size, mtime_ns)
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = hash_file(pathname)
+            self.dirty = True
+        # only once it is hashed, prune keeps the digests of used keys
+        self.used.add(key)
+        return digest
+
+    def prune(self):
+        """
+        drop digests of files which weren't seen since the last prune
+        """
+        if len(self.used) != len(self.digests):
+            self.digests = dict((key, self.digests[key]) for key in self.used)
+            self.dirty = True
+        self.used = set()
@@ -0,0 +1,143 @@
+"""
+minimal binding of linux inotify through ctypes
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+
+# events that change the content of a directory
+IN_STRUCTURE = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+)
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_STRUCTURE
+
+_event = struct.Struct("iIII")  # wd, mask, cookie, len
+
+_libc = None
+
+
+def get_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "libc doesn't provide inotify")
+        _libc = libc
+    return _libc
+
+
+def _raise_errno(filename=None):
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code), filename)
+
+
+class Inotify(object):
+    """
+    watch directories, each event is reported as (pathname, mask)
+
+    a directory may be watched under several pathnames, events are reported for each of them
+    """
+
+    def __init__(self):
+        self.libc = get_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+        self.watches = {}  # wd -> set of pathnames
+        self.descriptors = {}  # pathname -> wd
+
+    def add_watch(self, pathname, mask=WATCH_MASK):
+        if pathname in self.descriptors:
+            return self.descriptors[pathname]
+
+        encoded = pathname.encode(sys.getfilesystemencoding() or "utf-8")
+        wd = self.libc.inotify_add_watch(self.fd, encoded, mask | IN_ONLYDIR)
+        if wd < 0:
+            _raise_errno(pathname)
+
+        self.watches.setdefault(wd, set()).add(pathname)
+        self.descriptors[pathname] = wd
+        return wd
+
+    def remove_watch(self, pathname):
+        wd = self.descriptors.pop(pathname, None)
+        if wd is None:
+            return
+        pathnames = self.watches.get(wd, set())
+        pathnames.discard(pathname)
+        if not pathnames:
+            self.watches.pop(wd, None)
+            # the watch may be gone already if the directory was removed
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def read_events(self):
+        """
+        drain all pending events without blocking
+        """
+        buf = self.read()
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = _event.unpack_from(buf, offset)
+            offset += _event.size
+            name = buf[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                yield None, mask
+                continue
+
+            pathnames = self.watches.get(wd, ())
+            if mask & IN_IGNORED:
+                # the watched directory was removed
+                for pathname in list(pathnames):
+                    self.descriptors.pop(pathname, None)
+                self.watches.pop(wd, None)
+                continue
+
+            name = name.decode(sys.getfilesystemencoding() or "utf-8")
+            for pathname in pathnames:
+                yield os.path.join(pathname, name) if name else pathname, mask
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = {}
+        self.descriptors = {}
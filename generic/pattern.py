@@ -0,0 +1,89 @@
+"""
+compile glob patterns with brace expansion into regular expressions
+"""
+
+import re
+
+magic_check = re.compile(r"[*?[{]")
+
+_compiled = {}
+
+
+def has_magic(pathname):
+    return magic_check.search(pathname) is not None
+
+
+def _find_braces(pattern):
+    """
+    return {index of "{": index of the matching "}"}, unbalanced braces are literal
+    """
+    pairs = {}
+    stack = []
+    for index, c in enumerate(pattern):
+        if c == "{":
+            stack.append(index)
+        elif c == "}" and stack:
+            pairs[stack.pop()] = index
+    return pairs
+
+
+def translate(pattern):
+    """
+    same as fnmatch.translate but "{a,b}" matches either a or b, braces can be nested
+    """
+    pairs = _find_braces(pattern)
+    closing = []  # index of "}" of each open brace
+    res = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            res.append(".*")
+        elif c == "?":
+            res.append(".")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                res.append("\\[")
+            else:
+                stuff = pattern[i + 1 : j].replace("\\", "\\\\")
+                if stuff[0] == "!":
+                    stuff = "^" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+                res.append("[%s]" % stuff)
+                i = j
+        elif c == "{" and i in pairs:
+            closing.append(pairs[i])
+            res.append("(?:")
+        elif c == "," and closing:
+            res.append("|")
+        elif closing and i == closing[-1]:
+            closing.pop()
+            res.append(")")
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return "(?:%s)\\Z" % "".join(res)
+
+
+def compile_pattern(pattern):
+    regex = _compiled.get(pattern)
+    if regex is None:
+        regex = _compiled[pattern] = re.compile(translate(pattern), re.DOTALL)
+    return regex
+
+
+def compile_patterns(patterns):
+    """
+    compile patterns into a single regex matching any of them, None if there are none
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(translate(pattern) for pattern in patterns), re.DOTALL)
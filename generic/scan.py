@@ -0,0 +1,535 @@
+"""
+directory scanning built on os.scandir, every entry costs at most one stat
+"""
+
+import collections
+import errno
+import functools
+import itertools
+import os
+import stat
+import threading
+import time
+
+from runtime.pool import LazyPool, ThreadPoolExecutor
+
+# a pathname modified within the window may still change in the same mtime tick,
+# so what was read from it is not trusted in the next tick
+RACY_WINDOW = 2  # seconds
+
+# shared monitors reuse the scans of each other within a window of wall-clock time
+SHARE_WINDOW = 5  # seconds
+
+# seconds added to every stat and listing to simulate a network filesystem locally
+STAT_LATENCY = float(os.environ.get("GMAN_STAT_LATENCY", 0) or 0)
+
+# size of the thread pool shared by all monitors for parallel scans
+SCAN_THREADS = 16
+
+try:
+    from os import scandir
+except ImportError:  # python 2
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class Entry(object):
+    """
+    stand-in for os.DirEntry when scandir is not available
+    """
+
+    def __init__(self, dirname, name):
+        self.name = name
+        self.path = os.path.join(dirname, name)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self._lstat is None:
+                self._lstat = os.lstat(self.path)
+            return self._lstat
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self.stat(False).st_mode)
+        except OSError:
+            return False
+
+
+def _delay():
+    if STAT_LATENCY:
+        time.sleep(STAT_LATENCY)
+
+
+def stat_path(pathname):
+    """
+    os.stat with the injected latency, every stat of the scan goes through here
+    """
+    _delay()
+    return os.stat(pathname)
+
+
+def stat_entry(entry):
+    _delay()
+    return entry.stat()
+
+
+def get_mtime_ns(st):
+    mtime_ns = getattr(st, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return mtime_ns
+
+
+def is_racy(mtime_ns, now=None):
+    """
+    return whether a pathname with mtime_ns was modified within RACY_WINDOW of now
+    """
+    if now is None:
+        now = time.time()
+    return mtime_ns >= (now - RACY_WINDOW) * 1000000000
+
+
+def stat_file(pathname):
+    """
+    return (mtime_ns, size, inode, device) of pathname, symbolic links are followed
+    """
+    st = stat_path(pathname)
+    return get_mtime_ns(st), st.st_size, st.st_ino, st.st_dev
+
+
+def get_pathname_mtime_ns(pathname):
+    """
+    return the mtime of pathname, None if it doesn't exist
+    """
+    try:
+        return get_mtime_ns(stat_path(pathname))
+    except OSError:
+        return None
+
+
+def iter_entries(dirname):
+    _delay()
+    if scandir is None:
+        for name in os.listdir(dirname):
+            yield Entry(dirname, name)
+    else:
+        for entry in scandir(dirname):
+            yield entry
+
+
+def scan_files(dirname, cache=None):
+    """
+    yield (pathname, mtime_ns, size, inode, device) of non-hidden files in dirname
+    """
+    if cache is not None:
+        for pathname, value in cache.listdir(dirname).files.items():
+            yield (pathname,) + value
+        return
+
+    for entry in iter_entries(dirname):
+        if entry.name.startswith("."):
+            continue
+        try:
+            # file type comes from the directory listing, so only files get stat
+            if entry.is_dir(follow_symlinks=False):
+                continue
+            st = stat_entry(entry)
+        except OSError:
+            continue  # broken symbolic link or removed in the meantime
+        if stat.S_ISREG(st.st_mode):
+            yield entry.path, get_mtime_ns(st), st.st_size, st.st_ino, st.st_dev
+
+
+_pool = LazyPool(lambda: ThreadPoolExecutor(max_workers=SCAN_THREADS))
+
+
+def get_executor():
+    """
+    return the shared thread pool, None if concurrent.futures is not available
+    """
+    return _pool.get()
+
+
+def parallel_map(function, iterable, concurrency):
+    """
+    same as map(function, iterable) but calls run on the shared pool,
+    with at most concurrency calls of this map in flight
+    """
+    executor = get_executor() if concurrency > 1 else None
+    if executor is None:
+        for item in iterable:
+            yield function(item)
+        return
+
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= concurrency:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def gather_target(target):
+    """
+    return (pathname, mtime_ns, size, inode, device) of target or of the files in it
+    """
+    try:
+        # broken symbloic link does not have mtime stat, so cannot yield a broken link
+        st = stat_path(target)
+    except OSError:
+        return []
+
+    if stat.S_ISDIR(st.st_mode):
+        return list(scan_files(target))
+    return [(target, get_mtime_ns(st), st.st_size, st.st_ino, st.st_dev)]
+
+
+class SharedScan(object):
+    """
+    results of gather_target and listings of directories shared by monitors watching
+    overlapping trees
+
+    a tick is a window of SHARE_WINDOW seconds of wall-clock time, a result is reused
+    by every monitor which scans in the same tick, so a target is scanned once per
+    tick however many monitors watch it, even if they are due at different seconds or
+    run late. Results of older ticks are dropped.
+    """
+
+    def __init__(self):
+        self.results = {}  # (kind, pathname) -> (tick, result)
+        self.pending = {}  # (kind, pathname) -> threading.Event while it is scanned
+        self.latest = None
+        self.lock = threading.Lock()
+        self.hits = collections.Counter()  # kind -> results which were reused
+        self.misses = collections.Counter()  # kind -> results which were scanned
+
+    def current_tick(self):
+        return int(time.time() // SHARE_WINDOW)
+
+    def purge(self, tick):
+        # keep the previous tick for monitors which run late
+        if self.latest is not None:
+            self.results = dict(
+                (key, result)
+                for key, result in self.results.items()
+                if result[0] >= self.latest
+            )
+        self.latest = tick
+
+    def share(self, kind, pathname, tick, function):
+        key = (kind, pathname)
+        while True:
+            with self.lock:
+                if self.latest is None or tick > self.latest:
+                    self.purge(tick)
+                result = self.results.get(key)
+                if result is not None and result[0] >= tick:
+                    self.hits[kind] += 1
+                    return result[1]
+                event = self.pending.get(key)
+                if event is None:
+                    event = self.pending[key] = threading.Event()
+                    break
+            event.wait()  # being scanned by another monitor
+
+        try:
+            result = function(pathname)
+            with self.lock:
+                self.results[key] = (tick, result)
+                self.misses[kind] += 1
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+        return result
+
+    def gather(self, target, tick):
+        return self.share("gather", target, tick, gather_target)
+
+    def listdir(self, dirname, tick):
+        return self.share("listdir", dirname, tick, read_listing)
+
+
+shared_scan = SharedScan()
+
+
+class SharedListings(object):
+    """
+    listings of shared_scan in a tick, used as the cache of iglob
+
+    a listing may be taken earlier in the tick by another monitor, so the mtime of
+    the directory as of its listing is recorded in deps rather than the current one.
+    """
+
+    def __init__(self, tick, deps=None):
+        self.tick = tick
+        self.deps = deps
+
+    def listdir(self, dirname):
+        listing = shared_scan.listdir(dirname, self.tick)
+        if self.deps is not None:
+            self.deps.record(dirname, listing.mtime_ns)
+        return listing
+
+
+def list_dir(dirname, cache=None):
+    """
+    return (dirs, links, files) of non-hidden entries of dirname, None if it can't be
+    listed
+    """
+    try:
+        if cache is not None:
+            listing = cache.listdir(dirname)
+            return listing.dirs, listing.links, list(listing.files) + listing.others
+
+        dirs, links, files = [], set(), []
+        for entry in iter_entries(dirname):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                dirs.append(entry.path)
+                if entry.is_symlink():
+                    links.add(entry.path)
+            else:
+                files.append(entry.path)
+        return dirs, links, files
+    except OSError:
+        return None
+
+
+def walk(top, cache=None, prune=None, concurrency=1):
+    """
+    same as os.walk(top) but yields (dirname, dirs, files) with full pathnames,
+    hidden entries are skipped and symbolic links to directories are not followed
+
+    prune: a function of a directory, its subtree isn't walked if it returns True
+    concurrency: subdirectories are listed on up to concurrency threads of the pool
+    """
+    entries = list_dir(top, cache)
+    if entries is not None:
+        for item in _walk(top, entries, cache, prune, concurrency):
+            yield item
+
+
+def _walk(top, entries, cache, prune, concurrency):
+    dirs, links, files = entries
+    yield top, dirs, files
+
+    dirs = [
+        dirname
+        for dirname in dirs
+        if dirname not in links and (prune is None or not prune(dirname))
+    ]
+    listings = parallel_map(functools.partial(list_dir, cache=cache), dirs, concurrency)
+    for dirname, entries in zip(dirs, listings):
+        if entries is not None:
+            for item in _walk(dirname, entries, cache, prune, concurrency):
+                yield item
+
+
+class Listing(object):
+    """
+    non-hidden entries of a directory
+    """
+
+    def __init__(self, mtime_ns, stable):
+        self.mtime_ns = mtime_ns
+        self.stable = stable
+        self.generation = 0
+        self.dirs = []
+        self.links = set()  # symbolic links to directories
+        self.files = {}  # pathname -> (mtime_ns, size, inode, device) of files
+        self.others = []  # broken symbolic links, fifos, ...
+
+    @property
+    def names(self):
+        return [
+            os.path.basename(pathname)
+            for pathname in itertools.chain(self.dirs, self.files, self.others)
+        ]
+
+
+class ListingMemo(object):
+    """
+    list every directory at most once while expanding targets, files are not stat
+    so they are all in Listing.others
+    """
+
+    def __init__(self):
+        self.listings = {}  # dirname -> Listing
+
+    def listdir(self, dirname):
+        listing = self.listings.get(dirname)
+        if listing is None:
+            listing = self.listings[dirname] = read_listing(dirname, False)
+        return listing
+
+
+def read_listing(dirname, with_mtime=True):
+    """
+    return the Listing of dirname without stat of its files, the mtime of dirname is
+    taken before it is listed
+    """
+    mtime_ns = get_mtime_ns(stat_path(dirname)) if with_mtime else None
+    listing = Listing(mtime_ns, False)
+    for entry in iter_entries(dirname):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            listing.dirs.append(entry.path)
+            if entry.is_symlink():
+                listing.links.add(entry.path)
+        else:
+            listing.others.append(entry.path)
+    return listing
+
+
+class DirCache(object):
+    """
+    cache listings of directories across ticks
+
+    a directory is only listed again when its mtime changes, so files are only stat
+    in changed directories. Editing a file in place doesn't change the mtime of its
+    directory, tick(full=True) lists and stats everything again for those changes.
+    """
+
+    def __init__(self):
+        self.listings = {}  # dirname -> Listing
+        self.generation = 0
+        self.full = False
+
+    def tick(self, full=False):
+        # forget directories which weren't visited in the last tick
+        self.listings = dict(
+            (dirname, listing)
+            for dirname, listing in self.listings.items()
+            if listing.generation == self.generation
+        )
+        self.generation += 1
+        self.full = full
+
+    def read(self, dirname, st):
+        mtime_ns = get_mtime_ns(st)
+        listing = Listing(mtime_ns, not is_racy(mtime_ns))
+        for entry in iter_entries(dirname):
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir():
+                    listing.dirs.append(entry.path)
+                    if entry.is_symlink():
+                        listing.links.add(entry.path)
+                    continue
+                entry_st = stat_entry(entry)
+            except OSError:
+                listing.others.append(entry.path)
+                continue
+            if stat.S_ISREG(entry_st.st_mode):
+                listing.files[entry.path] = (
+                    get_mtime_ns(entry_st),
+                    entry_st.st_size,
+                    entry_st.st_ino,
+                    entry_st.st_dev,
+                )
+            else:
+                listing.others.append(entry.path)
+        return listing
+
+    def listdir(self, dirname):
+        """
+        return the Listing of dirname, costs one stat if it is unchanged
+        """
+        listing = self.listings.get(dirname)
+        if listing is not None and listing.generation == self.generation:
+            return listing
+
+        try:
+            st = stat_path(dirname)
+            if not stat.S_ISDIR(st.st_mode):
+                raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), dirname)
+        except OSError:
+            self.listings.pop(dirname, None)
+            raise
+
+        if (
+            self.full
+            or listing is None
+            or not listing.stable
+            or listing.mtime_ns != get_mtime_ns(st)
+        ):
+            listing = self.read(dirname, st)
+            self.listings[dirname] = listing
+
+        listing.generation = self.generation
+        return listing
+
+    def stat_file(self, pathname):
+        """
+        return (mtime_ns, size, inode, device) of a regular file from the listing of its
+        directory, None if it isn't known
+        """
+        dirname = os.path.dirname(pathname)
+        if not dirname:
+            return None
+        try:
+            return self.listdir(dirname).files.get(pathname)
+        except OSError:
+            return None
+
+
+class Dependencies(object):
+    """
+    mtimes of the files and directories a result was computed from
+
+    the result is still valid if none of them changed, a pathname which didn't exist
+    is recorded as None so creating it invalidates the result too.
+    """
+
+    def __init__(self):
+        self.mtimes = {}  # pathname -> mtime_ns
+        self.created = time.time()
+
+    def add(self, pathname):
+        if pathname not in self.mtimes:
+            self.mtimes[pathname] = get_pathname_mtime_ns(pathname)
+
+    def record(self, pathname, mtime_ns):
+        """
+        depend on pathname as of mtime_ns, e.g. when its listing was taken earlier
+        """
+        self.mtimes[pathname] = mtime_ns
+
+    @property
+    def stable(self):
+        return not any(
+            mtime_ns is not None and is_racy(mtime_ns, self.created)
+            for mtime_ns in self.mtimes.values()
+        )
+
+    def changed(self, concurrency=1):
+        pathnames = list(self.mtimes)
+        mtimes = parallel_map(get_pathname_mtime_ns, pathnames, concurrency)
+        for pathname, mtime_ns in zip(pathnames, mtimes):
+            if mtime_ns != self.mtimes[pathname]:
+                return True
+        return False
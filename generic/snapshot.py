@@ -0,0 +1,310 @@
+"""
+compact read-only mapping of pathname -> status for huge sets of targets
+"""
+
+import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+try:
+    array.array("q")
+    INT64 = "q"
+except ValueError:  # python 2
+    INT64 = "l"
+
+FS_ENCODING = sys.getfilesystemencoding() or "utf-8"
+FS_ERRORS = "surrogateescape" if sys.version_info >= (3,) else "strict"
+
+DEFAULT_COLUMNS = ("mtime_ns", "size")
+
+_missing = object()
+
+MAGIC = b"GMANSNAP"
+VERSION = 1
+# magic, version, byteorder, number of directories and sections, followed by the size of each section
+_header = struct.Struct("<8sBBQQ")
+_byteorder = 0 if sys.byteorder == "little" else 1
+
+
+def encode(pathname):
+    if isinstance(pathname, bytes):
+        return pathname
+    return pathname.encode(FS_ENCODING, FS_ERRORS)
+
+
+def decode(pathname):
+    if str is bytes:
+        return pathname
+    return pathname.decode(FS_ENCODING, FS_ERRORS)
+
+
+def _tobytes(column):
+    if hasattr(column, "tobytes"):
+        return column.tobytes()
+    return column.tostring()
+
+
+def _slice(buf, start, size):
+    if hasattr(memoryview, "cast"):
+        return memoryview(buf)[start : start + size]
+    return buf[start : start + size]
+
+
+def _frombuffer(buf, start, size):
+    """
+    return an int64 sequence backed by the mapping, or a copy on python 2
+    """
+    if hasattr(memoryview, "cast"):
+        return memoryview(buf)[start : start + size].cast(INT64)
+    column = array.array(INT64)
+    column.fromstring(buf[start : start + size])
+    return column
+
+
+class _Keys(object):
+    """
+    sequence view of the encoded pathnames for bisect
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, index):
+        return self.snapshot._key(index)
+
+
+class Snapshot(object):
+    """
+    pathnames are sorted and split into an interned directory and a basename,
+    basenames are packed into one bytes blob and every column of values is an
+    array of 64-bit integers.
+
+    values are tuples of the columns, or plain integers if there is only one column.
+    It has the dict-like interface MonitorBase uses: len, in, [], get, items, iteration.
+    """
+
+    def __init__(self, columns=DEFAULT_COLUMNS):
+        self.columns = tuple(columns)
+        self._dirs = []  # interned directories, with the trailing separator
+        self._dir_ids = array.array(INT64)
+        # basename i is _blob[offsets[i]:offsets[i+1]]
+        self._offsets = array.array(INT64, [0])
+        self._blob = b""
+        self._values = [array.array(INT64) for _ in self.columns]
+
+    @classmethod
+    def from_items(cls, items, columns=DEFAULT_COLUMNS):
+        """
+        build a snapshot from (pathname, value) pairs, the last value of a duplicated pathname wins
+        """
+        snapshot = cls(columns)
+        single = len(snapshot.columns) == 1
+        dir_index = {}
+        blob = bytearray()
+        previous = None
+
+        for key, value in sorted(
+            ((encode(pathname), value) for pathname, value in items),
+            key=lambda item: item[0],
+        ):
+            if single:
+                value = (value,)
+
+            if key == previous:
+                for column, item in zip(snapshot._values, value):
+                    column[-1] = item
+                continue
+            previous = key
+
+            sep = key.rfind(b"/") + 1
+            dirname = key[:sep]
+            dir_id = dir_index.get(dirname)
+            if dir_id is None:
+                dir_id = dir_index[dirname] = len(snapshot._dirs)
+                snapshot._dirs.append(dirname)
+
+            blob += key[sep:]
+            snapshot._dir_ids.append(dir_id)
+            snapshot._offsets.append(len(blob))
+            for column, item in zip(snapshot._values, value):
+                column.append(item)
+
+        snapshot._blob = bytes(blob)
+        return snapshot
+
+    def __len__(self):
+        return len(self._dir_ids)
+
+    def _key(self, index):
+        offsets = self._offsets
+        return (
+            self._dirs[self._dir_ids[index]]
+            + self._blob[offsets[index] : offsets[index + 1]]
+        )
+
+    def _value(self, index):
+        if len(self._values) == 1:
+            return self._values[0][index]
+        return tuple(column[index] for column in self._values)
+
+    def _index(self, pathname):
+        key = encode(pathname)
+        index = bisect.bisect_left(_Keys(self), key)
+        if index < len(self) and self._key(index) == key:
+            return index
+        return -1
+
+    def __contains__(self, pathname):
+        return self._index(pathname) >= 0
+
+    def __getitem__(self, pathname):
+        index = self._index(pathname)
+        if index < 0:
+            raise KeyError(pathname)
+        return self._value(index)
+
+    def get(self, pathname, default=None):
+        index = self._index(pathname)
+        if index < 0:
+            return default
+        return self._value(index)
+
+    def __iter__(self):
+        for key, value in self.iter_raw():
+            yield decode(key)
+
+    keys = __iter__
+
+    def values(self):
+        for index in range(len(self)):
+            yield self._value(index)
+
+    def items(self):
+        """
+        iterate over (pathname, value) in sorted order
+        """
+        for key, value in self.iter_raw():
+            yield decode(key), value
+
+    def iter_raw(self):
+        """
+        iterate over (encoded pathname, value) in sorted order
+        """
+        dirs = self._dirs
+        dir_ids = self._dir_ids
+        offsets = self._offsets
+        blob = self._blob
+        if len(self._values) == 1:
+            values = self._values[0]
+        else:
+            values = zip(*self._values)
+        for index, value in enumerate(values):
+            yield (
+                dirs[dir_ids[index]] + blob[offsets[index] : offsets[index + 1]],
+                value,
+            )
+
+    def replace(self, changes):
+        """
+        return a new snapshot with values in changes, a value of None removes the pathname
+        """
+        items = (
+            (pathname, changes.get(pathname, value)) for pathname, value in self.items()
+        )
+        items = ((pathname, value) for pathname, value in items if value is not None)
+        return Snapshot.from_items(
+            list(items) + [(p, v) for p, v in changes.items() if v is not None],
+            self.columns,
+        )
+
+    def save(self, filename):
+        """
+        write the snapshot atomically, the file can be memory-mapped by load
+        """
+        dirs = b"\0".join(self._dirs)
+        columns = "\0".join(self.columns).encode("utf-8")
+        sections = [columns, dirs, _tobytes(self._dir_ids), _tobytes(self._offsets)]
+        sections.extend(_tobytes(column) for column in self._values)
+        sections.append(bytes(self._blob))
+
+        dirname = os.path.dirname(filename) or os.curdir
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".snapshot_")
+        try:
+            with os.fdopen(fd, "wb") as fo:
+                fo.write(
+                    _header.pack(
+                        MAGIC, VERSION, _byteorder, len(self._dirs), len(sections)
+                    )
+                )
+                fo.write(
+                    struct.pack("<%sQ" % len(sections), *[len(s) for s in sections])
+                )
+                for section in sections:
+                    fo.write(section)
+                    fo.write(b"\0" * (-len(section) % 8))  # keep arrays aligned
+                fo.flush()
+                os.fsync(fo.fileno())
+            os.rename(tmpname, filename)
+        except Exception:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+    @classmethod
+    def load(cls, filename, columns=DEFAULT_COLUMNS):
+        """
+        memory-map a file written by save, return None if it was saved with other columns
+        or by an incompatible version
+        """
+        with open(filename, "rb") as fo:
+            buf = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, ndirs, nsections = _header.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION or byteorder != _byteorder:
+            return None
+        if nsections != 5 + len(columns):
+            return None
+
+        offset = _header.size
+        sizes = struct.unpack_from("<%sQ" % nsections, buf, offset)
+        offset += 8 * nsections
+        sections = []
+        for size in sizes:
+            sections.append((offset, size))
+            offset += size + (-size % 8)
+
+        start, size = sections[0]
+        if buf[start : start + size].decode("utf-8").split("\0") != list(columns):
+            return None
+
+        snapshot = cls(columns)
+        start, size = sections[1]
+        snapshot._dirs = buf[start : start + size].split(b"\0") if ndirs else []
+        snapshot._dir_ids = _frombuffer(buf, *sections[2])
+        snapshot._offsets = _frombuffer(buf, *sections[3])
+        snapshot._values = [_frombuffer(buf, *section) for section in sections[4:-1]]
+        start, size = sections[-1]
+        snapshot._blob = _slice(buf, start, size)
+        snapshot._mmap = buf  # keep the mapping alive
+        return snapshot
+
+    def __eq__(self, other):
+        if len(self) != len(other):
+            return False
+        for pathname, value in self.items():
+            if other.get(pathname, _missing) != value:
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "Snapshot(%s entries, columns=%s)" % (len(self), self.columns)
@@ -1,15 +1,17 @@
 from __future__ import print_function
-from monitors import FileMonitor, SvnMonitor, Scheduler
+from monitors import FileMonitor, SvnMonitor, GitMonitor, Scheduler
 from event import EventManger, ANY_EVENT
 from generic import gen_hier, indent, get_hier_basename
+from runtime import EventLoop, Supervisor, shard_of
+from generic import scan
+from monitors.SvnMonitor import SVN_THREADS, REPOSITORY_THREADS, configure_executor
+from monitors.GitMonitor import FETCH_PROCESSES, configure_executor as configure_fetch
 
 import logging
-import time
 import os
 import yaml
 import argparse
 import tempfile
-import traceback
 import copy
 import shutil
 
@@ -20,9 +22,11 @@ logger = logging.getLogger(__name__)
 TEMPDIR = os.path.join(os.getcwd(), ".gman_tempdir")
 tempfile.tempdir = TEMPDIR
 LOGFILE = "gman.log"
+THREADS = 4  # threads for collecting events of monitors concurrently
 
 
 COMMANDS = ("list-targets", "list-schedule", "run", "clean")
+ENGINES = ("default", "asyncio")
 
 
 def parse_args():
@@ -39,6 +43,14 @@ def parse_args():
         "-c", "--config", required=True, help="a yaml configurtion file"
     )
 
+    argparser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="shard jobs across N worker processes",
+    )
+
     return argparser.parse_args()
 
 
@@ -73,7 +85,7 @@ def rename_files(command):
         os.mkdir(TEMPDIR)
 
 
-def constructor(jobs, glob_env, project):
+def constructor(jobs, glob_env, project, state_dir=None):
     env_checker(glob_env)
 
     for name, settings in jobs.items():
@@ -92,12 +104,16 @@ def constructor(jobs, glob_env, project):
             raise ValueError("monitor field is empty at %s" % name)
 
         monitor_config["name"] = gen_hier(project, name)
+        if state_dir:
+            monitor_config.setdefault("state_dir", state_dir)
         monitor_type = monitor_config.get("type", "") or ""
 
         if monitor_type == "svn":
             monitor = SvnMonitor(**monitor_config)
         elif monitor_type == "file":
             monitor = FileMonitor(**monitor_config)
+        elif monitor_type == "git":
+            monitor = GitMonitor(**monitor_config)
         elif monitor_type == "scheduler":
             monitor = Scheduler(**monitor_config)
         else:
@@ -176,6 +192,33 @@ def setup_root_logger(is_debug):
     root_logger.addHandler(fh)
 
 
+def create_loop(monitors, working_env):
+    engine = working_env.get("engine", "default") or "default"
+    threads = int(working_env.get("threads", THREADS))
+    if engine not in ENGINES:
+        raise ValueError("This engine doesn't support: {0}".format(engine))
+
+    if engine == "asyncio":
+        from runtime.aio import AsyncEventLoop
+
+        return AsyncEventLoop(monitors, threads=threads)
+    return EventLoop(monitors, threads=threads)
+
+
+def run_loop(loop):
+    print("\nInitializing...")
+    loop.initialize()
+    print("Running...\nPress Ctrl+c to exit")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        print("\ntrying to terminate unfinished tasks before exit...\n")
+        logging.shutdown()
+        loop.kill()
+        print("goodbye...\n")
+        raise SystemExit(0)
+
+
 def event_loop(config=None):
     glob_env = os.environ.copy()
 
@@ -212,35 +255,59 @@ def event_loop(config=None):
 
     setup_root_logger(working_env.get("debug", False))
 
-    monitors = []
-    for monitor in constructor(working_env.get("jobs"), glob_env, project):
-        monitors.append(monitor)
+    state_dir = working_env.get("state_dir", None)
+    if state_dir and not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
 
-    if config is None:
-        helper(args.command, monitors, args.name)
+    scan.SCAN_THREADS = int(working_env.get("scan_threads", scan.SCAN_THREADS))
+    scan.SHARE_WINDOW = float(working_env.get("share_window", scan.SHARE_WINDOW))
+    configure_executor(
+        int(working_env.get("svn_threads", SVN_THREADS)),
+        int(working_env.get("svn_threads_per_repository", REPOSITORY_THREADS)),
+    )
+    configure_fetch(int(working_env.get("git_fetch_processes", FETCH_PROCESSES)))
 
-    print("\nInitializing...")
-    for monitor in monitors:
-        monitor.initialize()
-    print("Running...\nPress Ctrl+c to exit")
-    while True:
-        try:
-            for monitor in monitors:
-                try:
-                    monitor()
-                except Exception:
-                    traceback.print_exc()
-                time.sleep(1)
-        except KeyboardInterrupt:
-            print("\ntrying to terminate unfinished tasks before exit...\n")
-            logging.shutdown()
-            for monitor in monitors:
-                try:
-                    monitor.kill()
-                except Exception:
-                    traceback.print_exc()
-            print("goodbye...\n")
-            raise SystemExit(0)
+    jobs = copy.deepcopy(working_env.get("jobs"))
+
+    workers = int(working_env.get("workers", 1) or 1)
+    if config is None and args.workers:
+        workers = args.workers
+
+    if workers <= 1 or (config is None and args.command != "run"):
+        monitors = []
+        for monitor in constructor(
+            working_env.get("jobs"), glob_env, project, state_dir
+        ):
+            monitors.append(monitor)
+
+        if config is None:
+            helper(args.command, monitors, args.name)
+
+        run_loop(create_loop(monitors, working_env))
+        return
+
+    # monitors are only built in the worker which runs them
+
+    def run_worker(shard, workers):
+        # rebuild monitors from the untouched jobs, since constructor modifies them
+        monitors = [
+            monitor
+            for monitor in constructor(
+                copy.deepcopy(jobs), glob_env, project, state_dir
+            )
+            if shard_of(monitor.name, workers) == shard
+        ]
+        if monitors:
+            run_loop(create_loop(monitors, working_env))
+
+    supervisor = Supervisor(run_worker, workers)
+    print("\nStarting %s workers..." % workers)
+    supervisor.start()
+    try:
+        supervisor.run_forever()
+    except KeyboardInterrupt:
+        supervisor.kill()
+        raise SystemExit(0)
 
 
 if __name__ == "__main__":
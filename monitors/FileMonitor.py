@@ -1,24 +1,268 @@
-from MonitorBase import MonitorBase
+from .MonitorBase import MonitorBase
+from generic import inotify, scan
+from generic.pattern import has_magic
+from generic.hashcache import HashCache
+from generic.snapshot import Snapshot
+import errno
 import os
+import time
+
+POLL = "poll"
+INOTIFY = "inotify"
+BACKENDS = (POLL, INOTIFY)
+
+MTIME = "mtime"
+CONTENT = "content"
+DETECTS = (MTIME, CONTENT)
+UNREADABLE = 0  # digest of a file which was never read
+
+FULL_SWEEP = 3600  # seconds between full sweeps of an incremental monitor by default
+
+# errors meaning inotify can't be used, e.g. ENOSPC when the limit of watches is reached
+INOTIFY_ERRORS = (errno.ENOSPC, errno.EMFILE, errno.ENFILE, errno.ENOMEM, errno.ENOSYS)
 
 
 class FileMonitor(MonitorBase):
-    def gather_files(self):
-        for target in self.iter_targets():
-            if os.path.isdir(target):
-                for filename in os.listdir(target):
-                    if not filename.startswith("."):
-                        filename = os.path.join(target, filename)
-                        # if os.path.isfile(filename) and self.endswith(filename):
-                        if os.path.isfile(filename):
-                            yield filename
-            else:
-                # if os.path.lexists(target): # broken symbloic link does not have mtime stat, so cannot yield a broken link
-                if os.path.exists(target):
-                    yield target
+    def __init__(self, *args, **kwargs):
+        self.backend = kwargs.get("backend", POLL) or POLL
+        if self.backend not in BACKENDS:
+            raise ValueError(
+                "This backend doesn't support: {0}, choose from {1}".format(
+                    self.backend, BACKENDS
+                )
+            )
+        self.detect = kwargs.get("detect", MTIME) or MTIME
+        if self.detect not in DETECTS:
+            raise ValueError(
+                "This detect doesn't support: {0}, choose from {1}".format(
+                    self.detect, DETECTS
+                )
+            )
+        self.inotify = None
+        self.status = Snapshot()  # latest status which is maintained by inotify events
+        self.aliases = {}  # real pathname of symbolic link -> target
+        super(FileMonitor, self).__init__(*args, **kwargs)
+
+        # only list directories whose mtime changed, in-place edits of files are
+        # detected by a full sweep every full_sweep seconds
+        if kwargs.get("incremental", False):
+            self.dir_cache = scan.DirCache()
+        self.full_sweep = kwargs.get("full_sweep", None)
+        if self.full_sweep is None:
+            self.full_sweep = FULL_SWEEP
+
+        # share scans and listings with other monitors running in the same window of
+        # scan.SHARE_WINDOW seconds, so overlapping trees are scanned once. An
+        # incremental monitor keeps its own listings across ticks and relies on them
+        # being taken by its own sweeps, so it can't reuse the scans of others.
+        self.shared = bool(kwargs.get("shared", False))
+        if self.shared and self.dir_cache is not None:
+            raise ValueError("shared can't be combined with incremental")
+        self.scan_tick = None  # tick of scan.shared_scan of the running scan
+        self.last_sweep = time.time()
+
+        # a touched file is only MODIFIED if its content changed, a file is only
+        # hashed when its device, inode, size or mtime changed
+        self.hash_cache = None
+        if self.detect == CONTENT:
+            self.columns = ("digest",)
+            self.hash_cache = HashCache(self.hashes_file)
+
+    @property
+    def hashes_file(self):
+        if not self.state_dir:
+            return None
+        return os.path.splitext(self.state_file)[0] + ".hashes"
+
+    def listing_cache(self, deps):
+        if self.shared and self.scan_tick is not None:
+            return scan.SharedListings(self.scan_tick, deps)
+        return super(FileMonitor, self).listing_cache(deps)
+
+    def gather_files(self, targets=None):
+        """
+        yield (pathname, mtime_ns, size, inode, device) of files, each file costs a
+        single stat
+        """
+        if targets is None:
+            targets = self.iter_targets()
+
+        for items in scan.parallel_map(self.gather_target, targets, self.concurrency):
+            for item in items:
+                yield item
+
+    def gather_target(self, target):
+        """
+        return (pathname, mtime_ns, size, inode, device) of target or of the files in it
+        """
+        cache = self.dir_cache
+        # explicit targets are always stat, an in-place edit doesn't change the mtime
+        # of their directory
+        if cache is not None and target in self.swept_targets:
+            value = cache.stat_file(target)
+            if value is not None:
+                return [(target,) + value]
+            try:
+                return list(scan.scan_files(target, cache))
+            except OSError:
+                pass  # not a directory
+
+        if self.shared:
+            return scan.shared_scan.gather(target, self.scan_tick)
+        return scan.gather_target(target)
+
+    def get_value(self, pathname, mtime_ns, size, inode, device):
+        if self.hash_cache is None:
+            return mtime_ns, size
+        try:
+            return self.hash_cache.digest(pathname, device, inode, size, mtime_ns)
+        except (IOError, OSError) as e:
+            # an unreadable file keeps its last digest until it can be read again
+            self.logger.debug("Cannot hash {0}: {1}".format(pathname, e))
+            return self.before.get(pathname, UNREADABLE)
+
+    def poll_status(self, targets=None):
+        status = Snapshot.from_items(
+            ((item[0], self.get_value(*item)) for item in self.gather_files(targets)),
+            self.columns,
+        )
+        if self.hash_cache is not None:
+            self.hash_cache.prune()
+        return status
+
+    def tick(self):
+        if self.shared:
+            self.scan_tick = scan.shared_scan.current_tick()
+        if self.dir_cache is None:
+            return
+        now = time.time()
+        full = bool(self.full_sweep) and now - self.last_sweep >= self.full_sweep
+        if full:
+            self.last_sweep = now
+        self.dir_cache.tick(full)
 
     def get_status(self):
-        return dict([(f, os.path.getmtime(f)) for f in self.gather_files()])
+        status = self._get_status()
+        if self.hash_cache is not None:
+            try:
+                self.hash_cache.save()
+            except (IOError, OSError):
+                self.logger.exception("failed to save hashes: %s", self.hashes_file)
+        return status
+
+    def _get_status(self):
+        self.tick()
+        if self.backend == INOTIFY:
+            try:
+                return self.notified_status()
+            except OSError as e:
+                if e.errno not in INOTIFY_ERRORS:
+                    raise
+                self.logger.warning(
+                    "inotify failed: %s, fall back to polling", os.strerror(e.errno)
+                )
+                self.backend = POLL
+                self.close_inotify()
+
+        return self.poll_status()
+
+    def iter_static_dirs(self):
+        """
+        iterate over existing directories where new targets could show up
+        """
+        for target in self._targets:
+            if target.startswith("-f"):
+                continue
+            pathname = os.path.expandvars(target)
+            while has_magic(pathname) or not os.path.isdir(pathname or os.curdir):
+                parent = os.path.dirname(pathname)
+                if parent == pathname:
+                    break
+                pathname = parent
+            pathname = pathname or os.curdir
+            if os.path.isdir(pathname):
+                yield pathname
+
+    def rescan(self):
+        """
+        expand targets again, update watches and stat every file
+        """
+        targets = list(self.iter_targets())
+        dirs = set(self.iter_static_dirs())
+        aliases = {}
+        for target in targets:
+            if os.path.isdir(target):
+                dirs.add(target)
+                continue
+            dirs.add(os.path.dirname(target) or os.curdir)
+            if os.path.islink(target):
+                realpath = os.path.realpath(target)
+                aliases[realpath] = target
+                dirs.add(os.path.dirname(realpath))
+
+        for pathname in set(self.inotify.descriptors) - dirs:
+            self.inotify.remove_watch(pathname)
+        for pathname in dirs:
+            try:
+                self.inotify.add_watch(pathname)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue  # gone in the meantime, caught by the next rescan
+                raise
+
+        self.aliases = aliases
+        self.status = self.poll_status(targets)
+        return self.status
+
+    def notified_status(self):
+        """
+        only stat files reported by inotify, an idle tree costs a single read
+        """
+        if self.inotify is None:
+            self.inotify = inotify.Inotify()
+            return self.rescan()
+
+        changed = set()
+        for pathname, mask in self.inotify.read_events():
+            if mask & (inotify.IN_Q_OVERFLOW | inotify.IN_ISDIR):
+                # events were lost, or directories to watch may be added or removed
+                return self.rescan()
+            changed.add(self.aliases.get(pathname, pathname))
+
+        changes = {}
+        targets = None
+        for pathname in changed:
+            if pathname in self.status:
+                try:
+                    value = self.get_value(pathname, *scan.stat_file(pathname))
+                except OSError:
+                    value = None
+                changes[pathname] = value
+                continue
+
+            # a new file, the mtime of its directory makes the targets expanded again
+            if targets is None:
+                targets = set(self.iter_targets())
+            dirname, basename = os.path.split(pathname)
+            if pathname in targets or (
+                dirname in targets and not basename.startswith(".")
+            ):
+                for item in scan.gather_target(pathname):
+                    changes[item[0]] = self.get_value(*item)
+
+        if changes:
+            # self.before refers to the previous status, snapshots are never updated in place
+            self.status = self.status.replace(changes)
+        return self.status
+
+    def close_inotify(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def kill(self):
+        self.close_inotify()
+        super(FileMonitor, self).kill()
 
     # def endswith(self, string):
     #     if self.extensions is None:
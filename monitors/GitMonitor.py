@@ -0,0 +1,333 @@
+from .MonitorBase import MonitorBase, MODIFIED
+from generic import scan
+from generic.pattern import compile_patterns
+from generic.snapshot import Snapshot
+from runtime.pool import KeyedExecutor, LazyPool
+import binascii
+import os
+import struct
+import subprocess
+import threading
+import time
+
+FETCH_PROCESSES = 4  # git fetch running at once, shared by all GitMonitors
+
+# a repository is fetched by one process at a time
+_pool = LazyPool(lambda: KeyedExecutor(FETCH_PROCESSES, 1))
+
+_sha_struct = struct.Struct(">q")
+
+
+def configure_executor(processes=FETCH_PROCESSES):
+    """
+    set the limit of git fetch, takes effect before the first fetch is run
+    """
+    global FETCH_PROCESSES
+    FETCH_PROCESSES = processes
+
+
+def get_executor():
+    """
+    return the shared git fetch pool, None if concurrent.futures is not available
+    """
+    return _pool.get()
+
+
+def sha_to_int(sha):
+    """
+    return the first 64 bits of a hex object name as a signed int64, so it fits in
+    a Snapshot column
+    """
+    return _sha_struct.unpack(binascii.unhexlify(sha[:16]))[0]
+
+
+def int_to_sha(value):
+    """
+    return the abbreviated object name of a value returned by sha_to_int
+    """
+    return "%016x" % (value & 0xFFFFFFFFFFFFFFFF)
+
+
+def find_git_dir(target):
+    """
+    return (git dir, common dir) of a work tree, a linked work tree or a bare
+    repository, None if target isn't one of them
+    """
+    dotgit = os.path.join(target, ".git")
+    if os.path.isdir(dotgit):
+        git_dir = dotgit
+    elif os.path.isfile(dotgit):
+        # linked work trees and submodules point to their git dir
+        with open(dotgit, "r") as fo:
+            line = fo.readline().strip()
+        if not line.startswith("gitdir:"):
+            return None
+        git_dir = os.path.join(target, line[len("gitdir:") :].strip())
+    elif os.path.isfile(os.path.join(target, "HEAD")) and os.path.isdir(
+        os.path.join(target, "refs")
+    ):
+        git_dir = target
+    else:
+        return None
+
+    git_dir = os.path.normpath(git_dir)
+    common_dir = git_dir
+    commondir = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir):
+        with open(commondir, "r") as fo:
+            common_dir = os.path.normpath(os.path.join(git_dir, fo.read().strip()))
+    return git_dir, common_dir
+
+
+def parse_packed_refs(pathname):
+    """
+    return {refname: object name} of a packed-refs file, {} if it doesn't exist
+    """
+    refs = {}
+    try:
+        with open(pathname, "r") as fo:
+            for line in fo:
+                # "#" starts the header and "^" the peeled object of the tag above
+                if line[0] in "#^":
+                    continue
+                fields = line.split()
+                if len(fields) == 2:
+                    refs[fields[1]] = fields[0]
+    except (IOError, OSError):
+        pass
+    return refs
+
+
+class GitMonitor(MonitorBase):
+    """
+    report branches and tags of git repositories which move, by reading HEAD, refs/
+    and packed-refs directly
+
+    the directories under refs/ are only listed again when their mtime changes, git
+    updates a ref by renaming a new file into place, so it always changes the mtime
+    of its directory. A tick costs one stat per directory plus HEAD and packed-refs,
+    and reads only the files which changed.
+    """
+
+    columns = ("commit",)
+
+    def __init__(self, *args, **kwargs):
+        refs = kwargs.get("refs", None) or []
+        if not isinstance(refs, list):
+            refs = [refs]
+        self.refs_pattern = compile_patterns(refs)
+        self.fetch = kwargs.get("fetch", False) or False
+        self.git_dirs = {}  # target -> (git dir, common dir)
+        self.ref_cache = scan.DirCache()  # listings of refs/ directories
+        self.values = {}  # pathname -> ((mtime_ns, size, inode, device), content)
+        self.used = set()  # pathnames of self.values read in this tick
+        self.fetching = set()  # common dirs with a fetch queued or running
+        self.workers = set()  # git fetch in progress
+        self.lock = threading.Lock()
+        super(GitMonitor, self).__init__(*args, **kwargs)
+
+    def kill(self):
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            if worker.returncode is None:
+                try:
+                    worker.kill()
+                except OSError:
+                    pass
+        super(GitMonitor, self).kill()
+
+    def expand_targets(self):
+        targets, deps = super(GitMonitor, self).expand_targets()
+
+        kept = []
+        git_dirs = {}
+        for target in targets:
+            git_dir = find_git_dir(target)
+            if git_dir is None:
+                self.logger.error(
+                    "Drop: The pathname is not a git repository: {0}".format(target)
+                )
+                continue
+            git_dirs[target] = git_dir
+            kept.append(target)
+        self.git_dirs = git_dirs
+        return kept, deps
+
+    def target_dependencies(self, target):
+        # git init creates .git inside target, without touching its parent directory
+        return (target,) if os.path.isdir(target) else ()
+
+    def read_file(self, pathname, key):
+        """
+        return the first line of pathname, read again only when key, which is
+        (mtime_ns, size, inode, device) of it, changes
+        """
+        cached = self.values.get(pathname)
+        if cached is not None and cached[0] == key:
+            self.used.add(pathname)
+            return cached[1]
+
+        try:
+            with open(pathname, "r") as fo:
+                content = fo.readline().strip()
+        except (IOError, OSError):
+            return None
+        if not scan.is_racy(key[0]):
+            self.values[pathname] = (key, content)
+            self.used.add(pathname)
+        return content
+
+    def read_packed_refs(self, pathname):
+        try:
+            key = scan.stat_file(pathname)
+        except OSError:
+            return {}
+        cached = self.values.get(pathname)
+        if cached is not None and cached[0] == key:
+            self.used.add(pathname)
+            return cached[1]
+
+        refs = parse_packed_refs(pathname)
+        if not scan.is_racy(key[0]):
+            self.values[pathname] = (key, refs)
+            self.used.add(pathname)
+        return refs
+
+    def iter_loose_refs(self, dirname, prefix):
+        """
+        yield (refname, content) of the loose refs under dirname
+        """
+        try:
+            listing = self.ref_cache.listdir(dirname)
+        except OSError:
+            return
+        for pathname, key in listing.files.items():
+            name = os.path.basename(pathname)
+            # a ref is being updated by git
+            if name.endswith(".lock"):
+                continue
+            content = self.read_file(pathname, key)
+            if content:
+                yield prefix + "/" + name, content
+        for pathname in listing.dirs:
+            for ref in self.iter_loose_refs(
+                pathname, prefix + "/" + os.path.basename(pathname)
+            ):
+                yield ref
+
+    def read_refs(self, git_dir, common_dir):
+        """
+        return {refname: object name} of HEAD and everything under refs/,
+        symbolic refs are resolved
+        """
+        refs = dict(self.read_packed_refs(os.path.join(common_dir, "packed-refs")))
+        # loose refs take precedence over packed ones
+        refs.update(self.iter_loose_refs(os.path.join(common_dir, "refs"), "refs"))
+        head = os.path.join(git_dir, "HEAD")
+        try:
+            refs["HEAD"] = self.read_file(head, scan.stat_file(head))
+        except OSError:
+            pass
+
+        resolved = {}
+        for refname, value in refs.items():
+            # follow symbolic refs, e.g. HEAD -> refs/heads/master
+            for _ in range(5):
+                if value is None or not value.startswith("ref:"):
+                    break
+                value = refs.get(value[len("ref:") :].strip())
+            if value and not value.startswith("ref:"):
+                resolved[refname] = value
+        return resolved
+
+    def run_fetch(self, common_dir):
+        """
+        run git fetch of a repository, its output goes to the logger
+        """
+        command = ["git", "--git-dir", common_dir, "fetch", "--all", "--quiet"]
+        try:
+            try:
+                worker = subprocess.Popen(
+                    command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                )
+            except OSError as e:
+                self.logger.error(
+                    "Command failed: {0}\nERR: {1}".format(" ".join(command), e)
+                )
+                return
+            with self.lock:
+                self.workers.add(worker)
+            try:
+                output = worker.communicate()[0].decode("utf-8", "replace").strip()
+            finally:
+                with self.lock:
+                    self.workers.discard(worker)
+        finally:
+            with self.lock:
+                self.fetching.discard(common_dir)
+
+        if worker.returncode != 0:
+            self.logger.error(
+                "Command failed with {0}: {1}\nERR: {2}".format(
+                    worker.returncode, " ".join(command), output
+                )
+            )
+        elif output:
+            self.logger.debug("%s\n%s", " ".join(command), output)
+
+    def fetch_all(self, targets):
+        """
+        fetch the repositories of targets on the shared git fetch pool without waiting
+        for them, the refs they move are reported by a later tick
+        """
+        executor = get_executor()
+        for target in targets:
+            common_dir = self.git_dirs[target][1]
+            # work trees sharing a repository are fetched once
+            with self.lock:
+                if common_dir in self.fetching:
+                    continue
+                self.fetching.add(common_dir)
+            if executor is None:
+                worker = threading.Thread(target=self.run_fetch, args=(common_dir,))
+                worker.daemon = True
+                worker.start()
+            else:
+                executor.submit(common_dir, self.run_fetch, common_dir)
+
+    def get_status(self):
+        targets = list(self.iter_targets())
+        if self.fetch:
+            self.fetch_all(targets)
+
+        self.ref_cache.tick()
+        self.used = set()
+        status = {}
+        for target in targets:
+            git_dir, common_dir = self.git_dirs[target]
+            for refname, value in self.read_refs(git_dir, common_dir).items():
+                if self.refs_pattern is not None:
+                    if not self.refs_pattern.match(refname):
+                        continue
+                try:
+                    commit = sha_to_int(value)
+                except (TypeError, ValueError):
+                    continue  # not an object name
+                if refname == "HEAD":
+                    status[os.path.join(git_dir, refname)] = commit
+                else:
+                    status[os.path.join(common_dir, refname)] = commit
+
+        # forget files of refs which are gone
+        self.values = dict(
+            (pathname, value)
+            for pathname, value in self.values.items()
+            if pathname in self.used
+        )
+        return Snapshot.from_items(status.items(), self.columns)
+
+    def verbose(self, event, item, before, after):
+        if event == MODIFIED:
+            item = "{0} {1}..{2}".format(item, int_to_sha(before), int_to_sha(after))
+        super(GitMonitor, self).verbose(event, item, before, after)
@@ -3,19 +3,22 @@ import os
 
 # import sys
 import datetime
-import fnmatch
 import re
 from crontab import CronTab
 from generic import get_now, iglob, iter_filelist_reader
+from generic.scan import Dependencies, ListingMemo
+from generic.pattern import compile_patterns
+from generic.diff import MODIFIED, REMOVED, ADDED, iter_changes
+from generic.snapshot import Snapshot, DEFAULT_COLUMNS
 from event import EventManger, ANY_EVENT
-from fnmatch import fnmatch
 
+try:
+    from urllib.parse import quote
+except ImportError:  # python 2
+    from urllib import quote
 
-# logger = create_logger("Monitor")
 
-MODIFIED = "modified"
-REMOVED = "removed"
-ADDED = "added"
+# logger = create_logger("Monitor")
 
 crontan_pattern = r"every\s+(\d+)?\s+(second|minute|hour)s?"
 crontan_pattern = re.compile(crontan_pattern)
@@ -67,6 +70,20 @@ class Scheduler(object):
     def is_on_duty(self):
         return get_now() >= self.next_run
 
+    @property
+    def is_due(self):
+        return self.event_manager.is_done and self.is_on_duty
+
+    def collect_events(self):
+        """
+        return the events to dispatch, runtimes may call it off the loop thread
+        """
+        return [ANY_EVENT]
+
+    def dispatch(self, events):
+        for event in events:
+            self.event_manager.on(event)
+
     def add_event(self, event, callbacks, config, continue_on_error=False):
         self.event_manager.add_event(event, callbacks, config, continue_on_error)
 
@@ -77,9 +94,9 @@ class Scheduler(object):
             self.event_manager.add_success_handler(name, cmd, **kwargs)
 
     def __call__(self, event=ANY_EVENT):
-        if self.event_manager.is_done and self.is_on_duty:
+        if self.is_due:
             self.schedule_next_run()
-            self.event_manager.on(event)
+            self.dispatch([event])
 
     def kill(self):
         self.event_manager.kill()
@@ -88,6 +105,8 @@ class Scheduler(object):
 class MonitorBase(Scheduler):
     # logger = logger
 
+    columns = DEFAULT_COLUMNS  # columns of the Snapshot returned by get_status
+
     def __init__(self, schedule, targets, name="", **kwargs):
 
         super(MonitorBase, self).__init__(schedule, name, **kwargs)
@@ -100,21 +119,93 @@ class MonitorBase(Scheduler):
 
         self._targets = targets
         self.ignores = kwargs.get("ignores", None) or []
+        self.ignore_pattern = compile_patterns(self.ignores)
+        # "dir/*" ignores everything under dir, so its subtree isn't walked
+        self.prune_pattern = compile_patterns(
+            [ignore for ignore in self.ignores if ignore.endswith("*")]
+        )
+        self.dir_cache = None  # generic.scan.DirCache for expanding "**" incrementally
+        # (targets, dependencies) of the last expansion, see iter_targets
+        self.expansion = None
+        # targets found by walking a "**" pattern in the last expansion
+        self.swept_targets = set()
+        # the snapshot is saved under state_dir and reloaded by initialize
+        self.state_dir = kwargs.get("state_dir", None)
+        # stat and list on up to concurrency threads of the shared scan pool, which
+        # pays off on network filesystems where every stat is a round trip
+        self.concurrency = int(kwargs.get("concurrency", 1) or 1)
 
         # self.before = self.get_status()
         self.before = {}
 
-    def iter_targets(self):
+    def expand_targets(self):
+        """
+        return the filtered targets and the filelists and directories they depend on
+        """
+        deps = Dependencies()
+        cache = self.listing_cache(deps)
+        targets = []
+        swept = set()
         for target in self._targets:
             if target.startswith("-f"):
-                filelist = iter_filelist_reader(target)
+                filelist = iter_filelist_reader(target, deps=deps)
             else:
                 filelist = [target]
 
             for pathname in filelist:
-                for item in iglob(pathname, True):
+                for item in iglob(
+                    pathname,
+                    True,
+                    cache=cache,
+                    deps=deps,
+                    prune=self.is_pruned,
+                    concurrency=self.concurrency,
+                ):
+                    # the existence of item is checked in its parent directory
+                    deps.add(os.path.dirname(item) or os.curdir)
+                    for dependency in self.target_dependencies(item):
+                        deps.add(dependency)
                     if self.filter_target(item):
-                        yield item
+                        targets.append(item)
+                        if "**" in pathname:
+                            swept.add(item)
+        self.swept_targets = swept
+        return targets, deps
+
+    def listing_cache(self, deps):
+        """
+        return the cache of directory listings to expand targets with
+        """
+        # patterns sharing a directory match against the same listing
+        if self.dir_cache is not None:
+            return self.dir_cache
+        return ListingMemo()
+
+    def is_pruned(self, dirname):
+        """
+        whether every pathname under dirname is ignored
+        """
+        if self.prune_pattern is None:
+            return False
+        return self.prune_pattern.match(dirname + os.sep) is not None
+
+    def target_dependencies(self, target):
+        """
+        pathnames which filter_target(target) depends on besides the parent directory
+        """
+        return ()
+
+    def iter_targets(self):
+        """
+        targets are expanded again only when a filelist or a looked up directory changed
+        """
+        if self.expansion is not None:
+            targets, deps = self.expansion
+            if deps.stable and not deps.changed(self.concurrency):
+                return iter(targets)
+
+        self.expansion = self.expand_targets()
+        return iter(self.expansion[0])
 
     @property
     def targets(self):
@@ -122,13 +213,48 @@ class MonitorBase(Scheduler):
 
     def initialize(self):
         super(MonitorBase, self).initialize()
-        self.before = self.get_status()
+        before = self.load_snapshot()
+        if before is None:
+            self.before = self.get_status()
+            self.save_snapshot()
+        else:
+            # the first diff reports what changed while gman was down
+            self.before = before
+
+    @property
+    def state_file(self):
+        # percent-escaped, so different names never share a file
+        return os.path.join(self.state_dir, "%s.snapshot" % quote(self.name, safe=""))
+
+    def load_snapshot(self):
+        if not self.state_dir or not os.path.exists(self.state_file):
+            return None
+
+        try:
+            snapshot = Snapshot.load(self.state_file, self.columns)
+        except Exception:
+            self.logger.exception("failed to load snapshot: %s", self.state_file)
+            return None
+
+        if snapshot is None:
+            self.logger.warning("Drop: incompatible snapshot: %s", self.state_file)
+        else:
+            self.logger.info("Resume from snapshot: %s", self.state_file)
+        return snapshot
+
+    def save_snapshot(self):
+        if not self.state_dir or not isinstance(self.before, Snapshot):
+            return
+
+        try:
+            self.before.save(self.state_file)
+        except (IOError, OSError):
+            self.logger.exception("failed to save snapshot: %s", self.state_file)
 
     def filter_target(self, target):
-        for ignore in self.ignores:
-            if fnmatch(target, ignore):
-                self.logger.debug("Drop: user ignores: {0}".format(target))
-                return False
+        if self.ignore_pattern is not None and self.ignore_pattern.match(target):
+            self.logger.debug("Drop: user ignores: {0}".format(target))
+            return False
 
         if not os.path.lexists(target):
             self.logger.error("Drop: the pathname doesn't exist: {0}".format(target))
@@ -139,25 +265,31 @@ class MonitorBase(Scheduler):
     def get_status(self):
         raise NotImplementedError
 
-    def iter_diff(self, verbose=True):
+    def iter_changes(self):
+        """
+        return an iterator of (event, pathname, before, after), the missing side of an
+        added or removed pathname is -1. The new status is committed and saved before
+        it returns, however much of the iterator the caller consumes
+        """
         before = self.before
         after = self.get_status()
-        events = {
-            ADDED: [f for f in after if f not in before],
-            REMOVED: [f for f in before if f not in after],
-        }
-        events[MODIFIED] = [
-            f
-            for f, mtime in after.items()
-            if f not in events[ADDED] and mtime != before[f]
-        ]
+        changes = list(iter_changes(before, after))
         self.before = after
-        for event, items in events.items():
-            for item in items:
-                if verbose:
-                    self.verbose(event, item, before.get(item, -1), after.get(item, -1))
-            if items:
-                yield event, items
+
+        if changes:
+            self.save_snapshot()
+        return iter(changes)
+
+    def iter_diff(self, verbose=True):
+        events = {ADDED: [], REMOVED: [], MODIFIED: []}
+        for event, item, before, after in self.iter_changes():
+            events[event].append(item)
+            if verbose:
+                self.verbose(event, item, before, after)
+
+        for event in (ADDED, REMOVED, MODIFIED):
+            if events[event]:
+                yield event, events[event]
 
     def diff(self, verbose=True):
         return list(self.iter_diff(verbose=verbose))
@@ -170,11 +302,13 @@ class MonitorBase(Scheduler):
             )
         )
 
+    def collect_events(self):
+        return [event for event, items in self.iter_diff()]
+
     def __call__(self, event=None):
-        if self.event_manager.is_done and self.is_on_duty:
+        if self.is_due:
             self.schedule_next_run()
             if event:
-                self.event_manager.on(event)
+                self.dispatch([event])
             else:
-                for event, items in self.iter_diff():
-                    self.event_manager.on(event)
+                self.dispatch(self.collect_events())
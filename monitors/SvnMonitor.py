@@ -1,128 +1,460 @@
-import MonitorBase
+from .MonitorBase import MonitorBase, MODIFIED, REMOVED, ADDED
+from generic.snapshot import Snapshot
+import collections
+import contextlib
+import functools
 import subprocess
 import os
+import threading
 import xml.etree.ElementTree
 import time
 import tempfile
-from generic import indent
+from generic import indent, scan
+from runtime.pool import KeyedExecutor, LazyPool
 
 NAME_INDEX = -1
 REVISION_INDEX = 0
 
 ST_LOCK_COLUMN = 2
 
+BATCH_SIZE = 256  # targets per svn command, keeps the command line short
+UNVERSIONED = ("unversioned", "ignored")
+
+
+DEPTHS = ("empty", "files", "immediates", "infinity")
+
+SVN_THREADS = 8  # svn commands running at once, shared by all SvnMonitors
+REPOSITORY_THREADS = 2  # svn commands running at once against the same repository
+
+_pool = LazyPool(lambda: KeyedExecutor(SVN_THREADS, REPOSITORY_THREADS))
+
+
+def configure_executor(threads=SVN_THREADS, per_repository=REPOSITORY_THREADS):
+    """
+    set the limits of svn commands, takes effect before the first command is run
+    """
+    global SVN_THREADS, REPOSITORY_THREADS
+    SVN_THREADS = threads
+    REPOSITORY_THREADS = per_repository
+
+
+def get_executor():
+    """
+    return the shared svn command pool, None if concurrent.futures is not available
+    """
+    return _pool.get()
+
+
+def iter_elements(file_object, tag="entry"):
+    """
+    yield <tag> elements while the xml is parsed, each one is dropped once it is
+    processed so memory stays constant however long the output is
+    """
+    parents = []
+    try:
+        for event, elem in xml.etree.ElementTree.iterparse(
+            file_object, events=("start", "end")
+        ):
+            if event == "start":
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == tag:
+                yield elem
+                elem.clear()
+                if parents:
+                    del parents[-1][-1]  # elem is the last child of its parent
+    except xml.etree.ElementTree.ParseError:
+        return  # svn failed, the error is logged by open_command
+
+
+def read_all(file_object, size=65536):
+    while file_object.read(size):
+        pass
+
+
+def consume(function, *args, **kwargs):
+    return list(function(*args, **kwargs))
+
+
+def iter_chunks(items, size=BATCH_SIZE):
+    for index in range(0, len(items), size):
+        yield items[index : index + size]
+
+
+class SvnMonitor(MonitorBase):
+
+    columns = ("revision",)
 
-class SvnMonitor(MonitorBase.MonitorBase):
     def __init__(self, *args, **kwargs):
-        self.depth = kwargs.get("depth", "empty")
-        if self.depth != "empty":
-            raise NotImplementedError("Sorry! Only support depth==empty.")
-        self.worker = None
-        self.stdout = None
-        self.stderr = None
+        self.depth = kwargs.get("depth", "empty") or "empty"
+        if self.depth not in DEPTHS:
+            raise ValueError(
+                "This depth doesn't support: {0}, choose from {1}".format(
+                    self.depth, DEPTHS
+                )
+            )
+        self.workers = set()  # svn commands in progress
+        self.workers_lock = threading.Lock()
+        self.wc_dbs = {}  # directory -> wc.db of its working copy
+        self.urls = {}  # target -> (key of its wc.db, repository root, url)
+        self.versioned = {}  # target -> (key of its wc.db, whether it is versioned)
+        # (repository, before, after) -> (name of the log, paths relative to repository),
+        # an empty path is the repository itself
+        self.pending_logs = {}
         super(SvnMonitor, self).__init__(*args, **kwargs)
 
     def kill(self):
-        if self.worker is not None and self.worker.returncode is None:
-            try:
-                self.worker.kill()
-            except OSError:
-                pass
-        if self.stdout:
-            self.stdout.close()
-        if self.stderr:
-            self.stderr.close()
+        with self.workers_lock:
+            workers = list(self.workers)
+        for worker in workers:
+            if worker.returncode is None:
+                try:
+                    worker.kill()
+                except OSError:
+                    pass
         super(SvnMonitor, self).kill()
 
-    def run_command(self, command, wd=None, delete_log=True, **kwargs):
-        command.append("--non-interactive")
-
-        self.kill()  # for closing tempfile correctly
-
-        # self.stdout = tempfile.TemporaryFile(prefix="SvnMonitor_stdout_")
-        # self.stderr = tempfile.TemporaryFile(prefix="SvnMonitor_stderr_")
-        self.stdout = tempfile.NamedTemporaryFile(
-            prefix="SvnMonitor_stdout_", delete=delete_log, suffix=".log"
-        )
-        self.stderr = tempfile.NamedTemporaryFile(prefix="SvnMonitor_stderr_")
+    @contextlib.contextmanager
+    def open_command(self, command, wd=None, log=None, **kwargs):
+        """
+        run an svn command and yield a pipe of its stdout, which is read while svn
+        runs, or None if stdout goes to the file object log.
+        It can be used from several threads at once
+        """
+        command = command + ["--non-interactive"]
 
         worker = subprocess.Popen(
-            command, cwd=wd, stdout=self.stdout, stderr=self.stderr, **kwargs
+            command,
+            cwd=wd,
+            stdout=subprocess.PIPE if log is None else log,
+            stderr=subprocess.PIPE,
+            **kwargs
         )
-        self.worker = worker
-        worker.wait()
+        with self.workers_lock:
+            self.workers.add(worker)
+
+        # drained aside, svn blocks if a pipe is full
+        errors = []
+        drain = threading.Thread(target=lambda: errors.append(worker.stderr.read()))
+        drain.daemon = True
+        drain.start()
+
+        try:
+            yield worker.stdout
+            if worker.stdout is not None:
+                read_all(worker.stdout)  # anything left after a parse error
+        except BaseException:
+            # the output isn't wanted anymore
+            if worker.poll() is None:
+                worker.kill()
+            raise
+        finally:
+            if worker.stdout is not None:
+                worker.stdout.close()
+            worker.wait()
+            drain.join()
+            worker.stderr.close()
+            with self.workers_lock:
+                self.workers.discard(worker)
 
         if worker.returncode != 0:
-            self.stderr.seek(0)
             self.logger.error(
                 "Command failed with {0}: {1}\nERR: {2}".format(
                     worker.returncode,
                     " ".join(command),
-                    "".join(self.stderr.readlines()),
+                    b"".join(errors).decode("utf-8", "replace"),
                 )
             )
 
-        self.stdout.seek(0)
-        return self.stdout
-
-    def filter_target(self, target):
-
-        options = ["--depth", "empty", "--verbose"]
+    def run_command(self, command, wd=None, delete_log=True, log=None, **kwargs):
+        """
+        run an svn command to the end, its stdout is written to the file object log,
+        or kept in a new log file if delete_log is False, otherwise it is discarded.
+        Return the log file, which is closed
+        """
+        if log is None and not delete_log:
+            log = tempfile.NamedTemporaryFile(
+                prefix="SvnMonitor_stdout_", delete=False, suffix=".log"
+            )
+        try:
+            with self.open_command(command, wd, log, **kwargs) as stdout:
+                if stdout is not None:
+                    read_all(stdout)
+        finally:
+            if log is not None:
+                log.close()
+        return log
+
+    def run_jobs(self, jobs):
+        """
+        run (repository, function) jobs on the shared svn command pool, at most
+        REPOSITORY_THREADS of them against the same repository at once,
+        and return their results in order
+        """
+        executor = get_executor()
+        if executor is None:
+            return [function() for _, function in jobs]
+
+        futures = [
+            executor.submit(repository, function) for repository, function in jobs
+        ]
+        return [future.result() for future in futures]
+
+    def find_wc_db(self, dirname):
+        """
+        return .svn/wc.db of the working copy containing dirname, None if it isn't in one
+        """
+        dirname = os.path.abspath(dirname)
+        wc_db = self.wc_dbs.get(dirname)
+        if wc_db is None:
+            wc_db = os.path.join(dirname, ".svn", "wc.db")
+            if not os.path.exists(wc_db):
+                parent = os.path.dirname(dirname)
+                wc_db = None if parent == dirname else self.find_wc_db(parent)
+            # misses aren't cached, a checkout may turn dirname into a working copy
+            if wc_db is not None:
+                self.wc_dbs[dirname] = wc_db
+        return wc_db
+
+    def wc_db_of(self, target):
+        dirname = target if os.path.isdir(target) else os.path.dirname(target)
+        return self.find_wc_db(dirname or os.curdir)
+
+    def target_dependencies(self, target):
+        # svn add/delete changes whether target is versioned without touching its directory
+        wc_db = self.wc_db_of(target)
+        return (wc_db,) if wc_db else ()
+
+    def working_copy_of(self, target):
+        wc_db = self.wc_db_of(target)
+        if wc_db is None:
+            return None
+        return os.path.dirname(os.path.dirname(wc_db))
+
+    def iter_batches(self, targets):
+        """
+        group targets by working copy, yield (working copy, up to BATCH_SIZE targets)
+        so one svn command serves a whole batch
+        """
+        groups = collections.OrderedDict()
+        for target in targets:
+            groups.setdefault(self.working_copy_of(target), []).append(target)
+
+        for wc, targets in groups.items():
+            for batch in iter_chunks(targets):
+                yield wc, batch
+
+    def expand_targets(self):
+        targets, deps = super(SvnMonitor, self).expand_targets()
+
+        # whether a target is versioned only changes with the wc.db of its working copy
+        keys = {}  # wc.db -> its key, None if it isn't trusted yet
+        versioned = {}  # target -> whether it is versioned
+        unknown = []
+        for target in targets:
+            wc_db = self.wc_db_of(target)
+            if wc_db is None:
+                continue
+            if wc_db not in keys:
+                keys[wc_db] = self.wc_db_key(wc_db)
+            key = keys[wc_db]
+            cached = self.versioned.get(target)
+            if key is not None and cached is not None and cached[0] == key:
+                versioned[target] = cached[1]
+            else:
+                unknown.append(target)
+
+        batches = list(self.iter_batches(unknown))
+        # note that due to --depth=empty, the svn st yields one entry per target at most
+        # if it yields nothing, that means target is unversioned
+        jobs = [
+            (
+                wc,
+                functools.partial(
+                    consume, self.svn_st, batch, ["--depth", "empty", "--verbose"]
+                ),
+            )
+            for wc, batch in batches
+        ]
 
-        if super(SvnMonitor, self).filter_target(target):
-            # note that due to --depth=empty, the svn st only can yield one item or nothing
-            # if it yields nothing, that means target is unversioned. Otherwise, target is under version control
-            svn_st = self.svn_st(target=target, options=options)
-            try:
-                status = next(svn_st)
-                return True
-            except StopIteration:
+        for target in unknown:
+            versioned[target] = False
+        for (wc, batch), entries in zip(batches, self.run_jobs(jobs)):
+            svn_paths = self.svn_paths(batch)
+            for status in entries:
+                if status.get("item") not in UNVERSIONED:
+                    for target in svn_paths.get(status["path"], ()):
+                        versioned[target] = True
+
+        self.versioned = {}
+        for target, is_versioned in versioned.items():
+            key = keys[self.wc_db_of(target)]
+            if key is not None:
+                self.versioned[target] = (key, is_versioned)
+
+        kept = []
+        for target in targets:
+            if versioned.get(target):
+                kept.append(target)
+            else:
                 self.logger.error(
                     "Drop: The pathname is not under version control: {0}".format(
                         target
                     )
                 )
-                return False
-        return False
+        return kept, deps
+
+    def wc_db_key(self, wc_db):
+        """
+        return (mtime_ns, size) of wc_db, None if it is missing or racy
+        """
+        try:
+            st = os.stat(wc_db)
+        except OSError:
+            return None
+        mtime_ns = scan.get_mtime_ns(st)
+        if scan.is_racy(mtime_ns):
+            return None
+        return (mtime_ns, st.st_size)
+
+    def repository_of(self, wc, batch):
+        """
+        return the repository root of a batch, its working copy if the root isn't known
+        """
+        for target in batch:
+            if target in self.urls:
+                return self.urls[target][1]
+        return wc
+
+    def svn_paths(self, targets):
+        """
+        map the pathnames printed by svn, which are normalized, back to targets
+        """
+        paths = {}
+        for target in targets:
+            paths.setdefault(os.path.normpath(target), []).append(target)
+        return paths
 
     def svn_st(self, target="", options=None, **kwargs):
-        svn_st = ["svn", "st", "--xml", target]
+        targets = target if isinstance(target, list) else [target]
+        svn_st = ["svn", "st", "--xml"] + targets
 
         if isinstance(options, list):
             svn_st.extend(options)
 
-        file_object = self.run_command(svn_st, delete_log=True, **kwargs)
-        # TODO: change parse into iterpase
-        root = xml.etree.ElementTree.parse(file_object)
+        with self.open_command(svn_st, **kwargs) as stdout:
+            for entry in iter_elements(stdout):
+                path = entry.attrib.get("path")
+                wc_status = entry.find("wc-status")
+                wc_locked = wc_status.attrib.get("wc-locked", "false")
 
-        entries = root.findall("target/entry")
+                commit = wc_status.find("commit")
+                if commit is None:
+                    revision = "-1"
+                else:
+                    revision = commit.attrib.get("revision", "-1")
 
-        for entry in entries:
-            path = entry.attrib.get("path")
-            wc_status = entry.find("wc-status")
-            wc_locked = wc_status.attrib.get("wc-locked", "false")
+                item = wc_status.get("item", None)
+                yield dict(path=path, revision=revision, wc_locked=wc_locked, item=item)
 
-            commit = wc_status.find("commit")
-            if commit is None:
-                revision = "-1"
-            else:
-                revision = commit.attrib.get("revision", "-1")
+    def svn_info(self, target, options=None, **kwargs):
+        targets = target if isinstance(target, list) else [target]
+        svn_info = ["svn", "info", "--xml"] + targets
+        if options:
+            svn_info.extend(options)
+
+        with self.open_command(svn_info, **kwargs) as stdout:
+            for entry in iter_elements(stdout):
+                commit = entry.find("commit")
+                if commit is None:
+                    revision = "-1"
+                else:
+                    revision = commit.attrib.get("revision", "-1")
+                yield dict(
+                    path=entry.attrib.get("path"),
+                    url=entry.findtext("url"),
+                    root=entry.findtext("repository/root"),
+                    revision=revision,
+                )
 
-            item = wc_status.get("item", None)
-            yield dict(path=path, revision=revision, wc_locked=wc_locked, item=item)
+    def iter_behind(self, targets):
+        """
+        yield targets whose last changed revision is different at the repository head,
+        probed by one svn info per repository without touching working copies
+        """
+        # svn switch changes the url of a target, and its wc.db
+        keys = {}  # wc.db -> its key, None if it isn't trusted yet
+        unknown = []
+        for target in targets:
+            wc_db = self.wc_db_of(target)
+            if wc_db not in keys:
+                keys[wc_db] = self.wc_db_key(wc_db) if wc_db else None
+            cached = self.urls.get(target)
+            if cached is None or cached[0] is None or cached[0] != keys[wc_db]:
+                unknown.append(target)
+
+        # urls are looked up locally, one command serves several working copies
+        batches = list(iter_chunks(unknown))
+        jobs = [
+            (
+                self.working_copy_of(batch[0]),
+                functools.partial(consume, self.svn_info, batch),
+            )
+            for batch in batches
+        ]
+        for batch, infos in zip(batches, self.run_jobs(jobs)):
+            svn_paths = self.svn_paths(batch)
+            for info in infos:
+                for target in svn_paths.get(info["path"], ()):
+                    key = keys[self.wc_db_of(target)]
+                    self.urls[target] = (key, info["root"], info["url"])
+
+        repositories = collections.OrderedDict()
+        for target in targets:
+            if target not in self.urls or target not in self.before:
+                yield target
+                continue
+            repositories.setdefault(self.urls[target][1], []).append(target)
 
-    def svn_up(self, target=".", **kwargs):
-        svn_up = [
-            "svn",
-            "up",
-            target,
-            "--quiet",
+        batches = [
+            (root, batch)
+            for root, targets in repositories.items()
+            for batch in iter_chunks(targets)
+        ]
+        jobs = [
+            (
+                root,
+                functools.partial(
+                    consume,
+                    self.svn_info,
+                    [self.urls[target][2] for target in batch],
+                    ["--revision", "HEAD"],
+                ),
+            )
+            for root, batch in batches
         ]
+        for (root, batch), infos in zip(batches, self.run_jobs(jobs)):
+            heads = dict((info["url"], info["revision"]) for info in infos)
+
+            for target in batch:
+                head = heads.get(self.urls[target][2])
+                if head is None:
+                    # removed or moved on the server, or the probe failed
+                    del self.urls[target]
+                    yield target
+                elif int(head) != self.before[target]:
+                    yield target
+
+    def svn_up(self, target=".", **kwargs):
+        targets = target if isinstance(target, list) else [target]
+        svn_up = ["svn", "up"] + targets + ["--quiet"]
 
         return self.run_command(svn_up, **kwargs)
 
     def svn_log(self, target, options=None, **kwargs):
-        svn_log = ["svn", "log", target]
+        targets = target if isinstance(target, list) else [target]
+        svn_log = ["svn", "log"] + targets
         if options:
             if not isinstance(options, list):
                 raise TypeError("options should be a list.")
@@ -132,72 +464,126 @@ class SvnMonitor(MonitorBase.MonitorBase):
 
     def get_status(self):
         status = {}
-
-        for target in self.iter_targets():
-            if self.before:
-                self.svn_up(target)
-
-            svn_st = self.svn_st(
-                target=target,
-                options=[
-                    "--quiet",
-                    "--verbose",
-                    "--show-updates",
-                    "--depth",
-                    self.depth,
-                ],
+        targets = list(self.iter_targets())
+
+        if self.before:
+            # only update targets which are behind the repository
+            behind = list(self.iter_behind(targets))
+            self.run_jobs(
+                [
+                    (
+                        self.repository_of(wc, batch),
+                        functools.partial(self.svn_up, batch),
+                    )
+                    for wc, batch in self.iter_batches(behind)
+                    if wc is not None
+                ]
             )
 
-            svn_st = list(svn_st)
-
-            if len(svn_st) == 0:
-                continue
+        # every working copy is checked at once, up to the limits of the pool
+        batches = [item for item in self.iter_batches(targets) if item[0] is not None]
+        jobs = [
+            (
+                wc,
+                functools.partial(
+                    consume,
+                    self.svn_st,
+                    batch,
+                    ["--quiet", "--verbose", "--depth", self.depth],
+                ),
+            )
+            for wc, batch in batches
+        ]
 
-            # TODO: support --depth infinity
-            # currently only support --depth empty
-            svn_st = svn_st[0]
+        for (wc, batch), entries in zip(batches, self.run_jobs(jobs)):
+            svn_paths = self.svn_paths(batch)
 
-            wc_locked = svn_st.get("wc_locked", "false")
+            # with a depth other than empty, pathnames under targets are reported as
+            # they are printed by svn
+            for entry in entries:
+                for pathname in svn_paths.get(entry["path"], (entry["path"],)):
+                    wc_locked = entry.get("wc_locked", "false")
 
-            if wc_locked != "false":
-                if target in self.before:
-                    status[target] = self.before[target]
-                continue
+                    if wc_locked != "false":
+                        if pathname in self.before:
+                            status[pathname] = self.before[pathname]
+                        continue
 
-            revision = svn_st.get("revision")
+                    revision = entry.get("revision")
 
-            if revision != "" and revision != "-1":
-                status[target] = revision
+                    if revision != "" and revision != "-1":
+                        status[pathname] = int(revision)
 
-        return status
+        return Snapshot.from_items(status.items(), self.columns)
 
     def get_log(self, item, before, after):
-        out = self.svn_log(
-            item,
-            options=[
-                "--revision",
-                "{1}:{0}".format(after, int(before) + 1),
-                # "--xml",
-                "--verbose",
-            ],
-            delete_log=False,
-        )
-        return self.stdout.name
+        """
+        return the name of the file the svn log of item will be written to, logs are
+        fetched in the background by fetch_logs. Items of the same repository share
+        one log of their paths per range of revisions
+        """
+        if item in self.urls:
+            _, repository, url = self.urls[item]
+            path = url[len(repository) :].lstrip("/")
+        else:
+            repository, path = item, ""
+        key = (repository, int(before), int(after))
+        pending = self.pending_logs.get(key)
+        if pending is None:
+            # only the name is reserved, the file is opened once the log is fetched
+            fd, log = tempfile.mkstemp(prefix="SvnMonitor_stdout_", suffix=".log")
+            os.close(fd)
+            pending = self.pending_logs[key] = (log, [])
+        pending[1].append(path)
+        return pending[0]
+
+    def write_log(self, log, repository, paths, before, after):
+        options = ["--revision", "{0}:{1}".format(before + 1, after), "--verbose"]
+        # the log of the repository itself covers every path in it
+        batches = iter_chunks(paths) if all(paths) else [[]]
+        try:
+            for batch in batches:
+                # run_command closes the file once svn is done
+                self.svn_log([repository] + batch, options=options, log=open(log, "ab"))
+        except Exception:
+            self.logger.exception("Failed to get the log of {0}".format(repository))
+
+    def fetch_logs(self):
+        """
+        write the logs requested by get_log on the shared svn command pool, or on a
+        thread of their own without it, and don't wait for them
+        """
+        executor = get_executor()
+        for (repository, before, after), (log, paths) in self.pending_logs.items():
+            job = functools.partial(
+                self.write_log, log, repository, paths, before, after
+            )
+            if executor is None:
+                worker = threading.Thread(target=job)
+                worker.daemon = True
+                worker.start()
+            else:
+                executor.submit(repository, job)
+        self.pending_logs = {}
+
+    def iter_diff(self, verbose=True):
+        # logs are fetched once all changes are known, so they can be shared
+        events = list(super(SvnMonitor, self).iter_diff(verbose=verbose))
+        self.fetch_logs()
+        return iter(events)
 
     def verbose(self, event, path, before, after):
         title = "{revision} | {event} {path}{logs}"
         logs = ""
 
-        if event == MonitorBase.REMOVED:
+        if event == REMOVED:
             revision = "r%s" % before
-        elif event == MonitorBase.ADDED and os.path.isfile(path):
-            revision = "r%s:r%s" % (after, before)
-        elif event == MonitorBase.MODIFIED:
+        elif event == ADDED:
+            # files and, with a depth other than empty, directories
+            revision = "r%s" % after
+        else:
             revision = "r%s:r%s" % (after, before)
-
             logs = "\n%slog = %s" % (indent, self.get_log(path, before, after))
-        else:
-            raise NotImplementedError
 
         self.logger.info(
             "%s",
@@ -1,12 +1,14 @@
 from .MonitorBase import MonitorBase, MODIFIED, REMOVED, ADDED, Scheduler
 from .FileMonitor import FileMonitor
 from .SvnMonitor import SvnMonitor
+from .GitMonitor import GitMonitor
 
 
 __all__ = [
     MonitorBase,
     FileMonitor,
     SvnMonitor,
+    GitMonitor,
     MODIFIED,
     REMOVED,
     ADDED,
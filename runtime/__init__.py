@@ -0,0 +1,4 @@
+from .loop import EventLoop
+from .supervisor import Supervisor, shard_of
+
+__all__ = ["EventLoop", "Supervisor", "shard_of"]
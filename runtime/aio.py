@@ -0,0 +1,140 @@
+"""
+asyncio-based runtime, requires python 3.5+
+
+every monitor runs as its own task. Callbacks of os commands are spawned with
+asyncio.create_subprocess_exec and their exit is awaited, so a monitor with running
+callbacks doesn't need to be polled on every tick.
+"""
+
+import asyncio
+import functools
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from event.event import EXECUTE_FAIL
+from .loop import LOGGER, POLL_INTERVAL, get_time
+
+
+class AsyncPopen(object):
+    """
+    create a child process on the running asyncio loop, has same API as subprocess.Popen
+    """
+
+    def __init__(self, args, on_exit=None, **kwargs):
+        self.args = args
+        self.pid = 0
+        self.returncode = None
+        self._process = None
+        self._killed = False
+        self._on_exit = on_exit
+        self._task = asyncio.ensure_future(self._run(kwargs))
+
+    async def _run(self, kwargs):
+        try:
+            self._process = await asyncio.create_subprocess_exec(*self.args, **kwargs)
+            self.pid = self._process.pid
+            if self._killed:
+                self._process.kill()
+            self.returncode = await self._process.wait()
+        except Exception:
+            LOGGER.exception('failed to execute command "%s"', " ".join(self.args))
+            self.returncode = EXECUTE_FAIL
+        finally:
+            if self._on_exit is not None:
+                self._on_exit()
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self._killed = True
+        if self._process is not None and self.returncode is None:
+            self._process.kill()
+
+
+class AsyncEventLoop(object):
+    """
+    run every monitor as an asyncio task
+
+    collecting events (get_status) blocks, so it is done in the executor and
+    the events are dispatched back on the loop.
+    Error and success handlers keep using subprocess.Popen since they are run
+    synchronously through CallBack.communicate.
+    """
+
+    logger = LOGGER
+
+    def __init__(self, monitors, poll_interval=POLL_INTERVAL, threads=0):
+        self.monitors = list(monitors)
+        self.poll_interval = poll_interval
+        # None means the default executor of the loop
+        self.executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        self.loop = None
+        self._tasks = []
+
+    def initialize(self):
+        for monitor in self.monitors:
+            monitor.initialize()
+
+    async def _sleep_until(self, deadline):
+        timeout = (deadline - get_time()).total_seconds()
+        if timeout > 0:
+            await asyncio.sleep(timeout)
+
+    async def _wait_callbacks(self, monitor, wakeup):
+        # every child exit sets wakeup; the timeout covers python function callbacks
+        while True:
+            wakeup.clear()
+            if monitor.event_manager.is_done:
+                return
+            try:
+                await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _watch(self, monitor):
+        wakeup = asyncio.Event()
+        spawner = functools.partial(AsyncPopen, on_exit=wakeup.set)
+        for callback in monitor.event_manager.iter_callbacks():
+            callback.popen = spawner
+
+        while True:
+            await self._wait_callbacks(monitor, wakeup)
+            await self._sleep_until(monitor.next_run)
+            if not monitor.is_due:
+                continue
+
+            monitor.schedule_next_run()
+            try:
+                events = await self.loop.run_in_executor(
+                    self.executor, monitor.collect_events
+                )
+                monitor.dispatch(events)
+            except Exception:
+                traceback.print_exc()
+
+    async def _main(self):
+        self._tasks = [
+            asyncio.ensure_future(self._watch(monitor)) for monitor in self.monitors
+        ]
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+
+    def run_forever(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._main())
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def kill(self):
+        self.stop()
+        for monitor in self.monitors:
+            try:
+                monitor.kill()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,137 @@
+import datetime
+import heapq
+import itertools
+import logging
+import time
+import traceback
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED
+    from concurrent.futures import wait as wait_futures
+except ImportError:  # python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+
+LOGGER = logging.getLogger("Runtime")
+
+# how often a monitor with unfinished callbacks is polled again
+POLL_INTERVAL = 1  # seconds
+
+
+def get_time():
+    """
+    return current time with microsecond, for computing how long to sleep
+    """
+    return datetime.datetime.now()
+
+
+class EventLoop(object):
+    """
+    deadline-driven loop over monitors
+
+    every monitor is kept in a min-heap keyed on its next deadline. The loop
+    sleeps until the earliest deadline and only wakes the monitors that are due,
+    so the cost of one pass doesn't grow with the number of jobs.
+    A monitor whose callbacks are still running is due again after POLL_INTERVAL,
+    since its callback pool only progresses when it gets polled.
+
+    With threads > 0, events of due monitors are collected in a thread pool and
+    dispatched back on the loop thread, so one slow monitor doesn't delay the others.
+    """
+
+    logger = LOGGER
+
+    def __init__(self, monitors, poll_interval=POLL_INTERVAL, threads=0):
+        self.monitors = list(monitors)
+        self.poll_interval = datetime.timedelta(seconds=poll_interval)
+        self._queue = []  # heap of (deadline, sequence, monitor)
+        self._sequence = itertools.count()
+        self._pending = {}  # future -> monitor which is collecting events
+        self.executor = None
+        if threads > 0:
+            if ThreadPoolExecutor is None:
+                self.logger.warning(
+                    "concurrent.futures is not available, collect events sequentially"
+                )
+            else:
+                self.executor = ThreadPoolExecutor(threads)
+
+    def push(self, monitor, deadline=None):
+        if deadline is None:
+            deadline = self.get_deadline(monitor)
+        heapq.heappush(self._queue, (deadline, next(self._sequence), monitor))
+
+    def get_deadline(self, monitor):
+        now = get_time()
+        if monitor.event_manager.is_done and monitor.next_run is not None:
+            if monitor.next_run > now:
+                return monitor.next_run
+        # callbacks are still running, or the monitor failed to reschedule itself
+        return now + self.poll_interval
+
+    def initialize(self):
+        for monitor in self.monitors:
+            monitor.initialize()
+            self.push(monitor)
+
+    def pop_due(self):
+        """
+        pop all monitors whose deadline has passed
+        """
+        now = get_time()
+        while self._queue and self._queue[0][0] <= now:
+            yield heapq.heappop(self._queue)[2]
+
+    def wait(self):
+        """
+        sleep until the earliest deadline or until a pending collection is done
+        """
+        timeout = None
+        if self._queue:
+            timeout = max((self._queue[0][0] - get_time()).total_seconds(), 0)
+
+        if self._pending:
+            wait_futures(list(self._pending), timeout, FIRST_COMPLETED)
+        elif timeout:
+            time.sleep(timeout)
+
+    def submit(self, monitor):
+        monitor.schedule_next_run()
+        future = self.executor.submit(monitor.collect_events)
+        self._pending[future] = monitor
+
+    def apply_results(self):
+        for future in [future for future in self._pending if future.done()]:
+            monitor = self._pending.pop(future)
+            try:
+                monitor.dispatch(future.result())
+            except Exception:
+                traceback.print_exc()
+            self.push(monitor)
+
+    def run_once(self):
+        self.wait()
+        self.apply_results()
+        for monitor in list(self.pop_due()):
+            try:
+                if self.executor is not None and monitor.is_due:
+                    self.submit(monitor)
+                    continue
+                # runs inline, or only polls the running callbacks
+                monitor()
+            except Exception:
+                traceback.print_exc()
+            self.push(monitor)
+
+    def run_forever(self):
+        while self._queue or self._pending:
+            self.run_once()
+
+    def kill(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        for monitor in self.monitors:
+            try:
+                monitor.kill()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,88 @@
+import collections
+import os
+import threading
+
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except ImportError:  # python 2 without the futures backport
+    Future = ThreadPoolExecutor = None
+
+
+class LazyPool(object):
+    """
+    pool created by factory on first use, once per process
+
+    threads don't survive fork, so a worker process creates its own pool. get returns
+    None if concurrent.futures is not available.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.pool = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if ThreadPoolExecutor is None:
+            return None
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = self.factory()
+                self.pid = os.getpid()
+        return self.pool
+
+
+class KeyedExecutor(object):
+    """
+    thread pool which runs at most `threads` calls in total and at most `per_key`
+    calls with the same key, e.g. svn commands against the same repository
+
+    calls over the limit of their key wait in a queue of that key, so they don't
+    hold a thread of the pool while calls of other keys could run.
+    """
+
+    def __init__(self, threads, per_key):
+        self.per_key = max(1, per_key)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.lock = threading.Lock()
+        self.running = collections.Counter()  # key -> calls handed to the pool
+        self.queues = {}  # key -> deque of (future, function, args, kwargs)
+
+    def submit(self, key, function, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            self.queues.setdefault(key, collections.deque()).append(
+                (future, function, args, kwargs)
+            )
+            self._dispatch(key)
+        return future
+
+    def _dispatch(self, key):
+        """
+        hand queued calls of key to the pool up to its limit, the lock must be held
+        """
+        queue = self.queues.get(key)
+        while queue and self.running[key] < self.per_key:
+            self.running[key] += 1
+            self.executor.submit(self._run, key, *queue.popleft())
+        if not queue:
+            self.queues.pop(key, None)
+
+    def _run(self, key, future, function, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = function(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self.lock:
+                self.running[key] -= 1
+                if not self.running[key]:
+                    del self.running[key]
+                self._dispatch(key)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import time
+import zlib
+
+LOGGER = logging.getLogger("Supervisor")
+
+RESTART_DELAY = 5  # seconds to wait before restarting a crashed worker
+
+
+def shard_of(name, workers):
+    """
+    map a job name onto a worker, stable across processes and restarts
+    """
+    return zlib.crc32(name.encode("utf-8")) % workers
+
+
+def get_context():
+    # worker processes inherit logging handlers and the working environment by fork
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("fork")
+    return multiprocessing
+
+
+class Supervisor(object):
+    """
+    run target(shard, workers) in worker processes and restart crashed workers
+
+    a worker which exits with 0 is finished and won't be restarted
+    """
+
+    logger = LOGGER
+
+    def __init__(self, target, workers, restart_delay=RESTART_DELAY):
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.processes = {}  # shard -> process
+        self.crashed = {}  # shard -> time of crash
+        self.restarts = 0
+        self.context = get_context()
+
+    def spawn(self, shard):
+        process = self.context.Process(
+            target=self.target,
+            args=(shard, self.workers),
+            name="gman-worker-%s" % shard,
+        )
+        process.start()
+        self.processes[shard] = process
+        self.logger.info(
+            "worker %s/%s started, PID = %s", shard, self.workers, process.pid
+        )
+
+    def start(self):
+        for shard in range(self.workers):
+            self.spawn(shard)
+
+    def poll(self):
+        now = time.time()
+        for shard, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if process.exitcode == 0:
+                self.logger.info("worker %s/%s finished", shard, self.workers)
+                del self.processes[shard]
+                continue
+
+            if shard not in self.crashed:
+                self.logger.error(
+                    "worker %s/%s crashed with %s, restart in %ss",
+                    shard,
+                    self.workers,
+                    process.exitcode,
+                    self.restart_delay,
+                )
+                self.crashed[shard] = now
+
+            if now - self.crashed[shard] >= self.restart_delay:
+                del self.crashed[shard]
+                self.restarts += 1
+                self.spawn(shard)
+
+        return bool(self.processes)
+
+    def run_forever(self, interval=1):
+        while self.poll():
+            time.sleep(interval)
+
+    def kill(self, timeout=30):
+        # workers receive the same Ctrl+c, give them a chance to clean up
+        deadline = time.time() + timeout
+        for process in self.processes.values():
+            process.join(max(deadline - time.time(), 0))
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
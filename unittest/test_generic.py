@@ -0,0 +1,163 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+
+# local packages
+from generic.snapshot import Snapshot
+from generic.diff import ADDED, REMOVED, MODIFIED, iter_changes
+from generic.pattern import compile_pattern, has_magic
+import generic.scan
+from generic.filelist_reader import FilelistCache, filelist_cache, iter_filelist_reader
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_dict_like_interface(self):
+        golden = {}
+        for index in range(2000):
+            pathname = "root/dir_%s/sub_%s/file_%s.sv" % (index % 7, index % 3, index)
+            golden[pathname] = (random.randint(0, 2**62), index)
+        golden["top_level_file"] = (1, 2)
+
+        snapshot = Snapshot.from_items(golden.items())
+        self.assertEqual(len(snapshot), len(golden))
+        self.assertEqual(list(snapshot), sorted(golden))
+        self.assertEqual(dict(snapshot.items()), golden)
+        for pathname, value in golden.items():
+            self.assertIn(pathname, snapshot)
+            self.assertEqual(snapshot[pathname], value)
+        self.assertNotIn("root/dir_0", snapshot)
+        self.assertEqual(snapshot.get("not/exist", -1), -1)
+        self.assertRaises(KeyError, lambda: snapshot["not/exist"])
+        self.assertEqual(snapshot, golden)
+
+    def test_replace(self):
+        snapshot = Snapshot.from_items(
+            [("a/1", 1), ("a/2", 2), ("b/1", 3)], ["revision"]
+        )
+        self.assertEqual(snapshot["a/2"], 2)
+        replaced = snapshot.replace({"a/1": None, "a/2": 5, "c/1": 6})
+        self.assertEqual(dict(replaced.items()), {"a/2": 5, "b/1": 3, "c/1": 6})
+        self.assertEqual(dict(snapshot.items()), {"a/1": 1, "a/2": 2, "b/1": 3})
+
+
+class TestDiff(unittest.TestCase):
+    def test_iter_changes(self):
+        before = dict(("dir_%s/file_%s" % (i % 13, i), (i, 1)) for i in range(3000))
+        after = dict(before)
+        golden = set()
+        for i, pathname in enumerate(sorted(before)):
+            if i % 7 == 0:
+                del after[pathname]
+                golden.add((REMOVED, pathname, before[pathname], -1))
+            elif i % 5 == 0:
+                after[pathname] = (i + 1, 1)
+                golden.add((MODIFIED, pathname, before[pathname], after[pathname]))
+        for i in range(500):
+            after["new/file_%s" % i] = (i, 2)
+            golden.add((ADDED, "new/file_%s" % i, -1, (i, 2)))
+
+        self.assertEqual(set(iter_changes(before, after)), golden)
+        self.assertEqual(
+            set(
+                iter_changes(
+                    Snapshot.from_items(before.items()),
+                    Snapshot.from_items(after.items()),
+                )
+            ),
+            golden,
+        )
+        self.assertEqual(list(iter_changes(after, after)), [])
+
+
+class TestPattern(unittest.TestCase):
+    def test_braces(self):
+        tests = [
+            ("*.{sv,v}", ["a.sv", "a.v"], ["a.svh", "a.h", "sv"]),
+            ("{a,b{1,2}}_*", ["a_x", "b1_", "b2_y"], ["b_x", "b3_x", "c_x"]),
+            ("[!a]?.{v}", ["bc.v"], ["ac.v", "b.v"]),
+            ("{a,b", ["{a,b"], ["a"]),
+            ("a}.v", ["a}.v"], ["a.v"]),
+        ]
+        for pattern, matches, mismatches in tests:
+            match = compile_pattern(pattern).match
+            for name in matches:
+                self.assertTrue(match(name), (pattern, name))
+            for name in mismatches:
+                self.assertFalse(match(name), (pattern, name))
+
+    def test_has_magic(self):
+        self.assertTrue(has_magic("root/{a,b}/x.v"))
+        self.assertTrue(has_magic("root/*.v"))
+        self.assertFalse(has_magic("root/a.v"))
+
+
+class TestFilelistReader(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # cache fresh filelists
+        filelist_cache.entries = {}
+
+    def tearDown(self):
+        filelist_cache.entries = {}
+        generic.scan.RACY_WINDOW = self.racy_window
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def write(self, name, content):
+        pathname = os.path.join(self.dirname, name)
+        with open(pathname, "w") as fo:
+            fo.write(content)
+        return pathname
+
+    def test_nested_filelists(self):
+        os.environ["GMAN_TEST_DIR"] = "env_dir"
+        self.addCleanup(os.environ.pop, "GMAN_TEST_DIR", None)
+        inner = self.write("inner.f", "c.v // comment\n+incdir+inc1+inc2\n")
+        top = self.write(
+            "top.f",
+            "a.v  b.sv\n// c.v\n-f %s\n-v lib.v +define+X=1 -y\n$GMAN_TEST_DIR/d.v\n"
+            % inner,
+        )
+        cache = FilelistCache()
+        answer = list(iter_filelist_reader("-f " + top, cache=cache))
+        golden = [top, "a.v", "b.sv", inner, "c.v", "inc1", "inc2", "lib.v"]
+        golden.append("env_dir/d.v")
+        self.assertEqual(answer, golden)
+
+        # unchanged filelists are not parsed again
+        entries = dict(cache.entries)
+        answer = list(iter_filelist_reader("-f " + top, cache=cache))
+        self.assertEqual(answer, golden)
+        for filelist, cached in cache.entries.items():
+            self.assertIs(cached, entries[filelist])
+
+        self.write("inner.f", "c.v e.v\n")
+        answer = list(iter_filelist_reader("-f " + top, cache=cache))
+        self.assertEqual(answer[4:6], ["c.v", "e.v"])
+        self.assertIs(cache.entries[top], entries[top])
+
+    def test_changed_variable(self):
+        os.environ["GMAN_TEST_DIR"] = "first"
+        self.addCleanup(os.environ.pop, "GMAN_TEST_DIR", None)
+        top = self.write("top.f", "a.v\n${GMAN_TEST_DIR}/b.v\n")
+        cache = FilelistCache()
+        self.assertEqual(
+            list(iter_filelist_reader(top, cache=cache)), [top, "a.v", "first/b.v"]
+        )
+        os.environ["GMAN_TEST_DIR"] = "second"
+        self.assertEqual(
+            list(iter_filelist_reader(top, cache=cache)), [top, "a.v", "second/b.v"]
+        )
+
+    def test_include_cycle(self):
+        first = os.path.join(self.dirname, "first.f")
+        second = self.write("second.f", "b.v\n-f %s\n" % first)
+        self.write("first.f", "a.v\n-f %s\n" % second)
+        reader = iter_filelist_reader(first)
+        self.assertRaises(ValueError, list, reader)
+
+
+if __name__ == "__main__":
+    unittest.main()
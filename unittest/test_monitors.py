@@ -1,14 +1,26 @@
 import unittest
 import shutil
+import errno
 import os
+import sys
 import subprocess
 import shlex
 import json
+import tempfile
+import io
+import threading
+import time
+import fnmatch
 from time import sleep
 
 # local packages
 import monitors
 import generic
+import generic.hashcache
+import generic.inotify
+import generic.scan
+from monitors.GitMonitor import int_to_sha
+from monitors.SvnMonitor import iter_elements
 import random
 
 # import collections
@@ -100,6 +112,9 @@ class TestFileMonitor(unittest.TestCase):
             "root/**/*/*.py",
             "root",
             "root/",
+            "root/{f2,f3}/*/*.{sv,v}",
+            "root/f{2,3}/ff{2,3}_2/{sub*,*.sv}",
+            "root/{f1,f3}/**/__{init,main}__.py",
         ]
 
         for test in tests:
@@ -177,6 +192,384 @@ class TestFileMonitor(unittest.TestCase):
                     diff = set(golden[event]) - set(items)
                     self.assertEqual(len(items), len(set(golden[event])))
 
+    def test_scan_files(self):
+        for dirname in generic.iglob("root/**/"):
+            golden = [
+                os.path.join(dirname, name)
+                for name in os.listdir(dirname)
+                if name[0] != "." and os.path.isfile(os.path.join(dirname, name))
+            ]
+            answer = list(generic.scan.scan_files(dirname))
+            self.assertEqual(sorted(golden), sorted(f for f, _, _, _, _ in answer))
+            for pathname, mtime_ns, size, inode, device in answer:
+                self.assertEqual(size, os.path.getsize(pathname))
+                self.assertEqual(inode, os.stat(pathname).st_ino)
+                self.assertEqual(device, os.stat(pathname).st_dev)
+
+    def test_FileMonitor_incremental(self):
+        racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # trust listings of the fresh tree
+        try:
+            file_monitor = monitors.FileMonitor(
+                "@hourly", "root/**", incremental=True, full_sweep=1
+            )
+            file_monitor.initialize()
+            targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+
+            pathname = os.path.join(os.path.dirname(targets[0]), "incremental.add_file")
+            touch(pathname)
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.ADDED, [pathname])]
+            )
+
+            # in-place edits are only seen by the full sweep
+            sleep(0.1)
+            touch(targets[0])
+            self.assertEqual(file_monitor.diff(verbose=False), [])
+            sleep(1)
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.MODIFIED, [targets[0]])]
+            )
+            os.remove(pathname)
+        finally:
+            generic.scan.RACY_WINDOW = racy_window
+
+    def test_FileMonitor_incremental_explicit_targets(self):
+        racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # trust listings of the fresh tree
+        try:
+            explicit = [f for f in generic.iglob("root/f2/*") if os.path.isfile(f)][0]
+            file_monitor = monitors.FileMonitor(
+                "@hourly", ["root/f1/**", explicit], incremental=True
+            )
+            self.assertEqual(file_monitor.full_sweep, 3600)
+            file_monitor.initialize()
+
+            # explicit targets are stat on every tick, without a full sweep
+            sleep(0.1)
+            touch(explicit)
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.MODIFIED, [explicit])]
+            )
+        finally:
+            generic.scan.RACY_WINDOW = racy_window
+
+    def test_FileMonitor_ignores(self):
+        ignores = ["*/submodules/*", "*.py", "root/f{1,2}/*_0"]
+        expanded = ["*/submodules/*", "*.py", "root/f1/*_0", "root/f2/*_0"]
+        golden = [
+            pathname
+            for pathname in monitors.FileMonitor("@hourly", "root/**").targets
+            if not any(fnmatch.fnmatch(pathname, ignore) for ignore in expanded)
+        ]
+
+        listed = []
+        iter_entries = generic.scan.iter_entries
+
+        def spy(dirname):
+            listed.append(dirname)
+            return iter_entries(dirname)
+
+        generic.scan.iter_entries = spy
+        try:
+            file_monitor = monitors.FileMonitor("@hourly", "root/**", ignores=ignores)
+            self.assertEqual(file_monitor.targets, golden)
+        finally:
+            generic.scan.iter_entries = iter_entries
+        # ignored subtrees are never listed
+        self.assertTrue(listed)
+        self.assertFalse([dirname for dirname in listed if "submodules" in dirname])
+
+    def test_FileMonitor_parallel_scan(self):
+        golden = monitors.FileMonitor("@hourly", "root/**").get_status()
+        lock = threading.Lock()
+        running = [0]
+        peaks = []  # most stats and listings in flight at once, of each step
+
+        def delay():
+            # simulate a network filesystem
+            with lock:
+                running[0] += 1
+                peaks[-1] = max(peaks[-1], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        _delay = generic.scan._delay
+        racy_window = generic.scan.RACY_WINDOW
+        generic.scan._delay = delay
+        generic.scan.RACY_WINDOW = -1  # trust mtimes of the fresh tree
+        try:
+            for concurrency in (1, 8):
+                file_monitor = monitors.FileMonitor(
+                    "@hourly", "root/**", concurrency=concurrency
+                )
+                peaks.append(0)  # walk "**"
+                targets = file_monitor.targets
+                peaks.append(0)  # check the looked up directories
+                self.assertIs(file_monitor.targets[0], targets[0])
+                peaks.append(0)  # stat targets and list the directories
+                self.assertEqual(file_monitor.poll_status(targets), golden)
+        finally:
+            generic.scan._delay = _delay
+            generic.scan.RACY_WINDOW = racy_window
+        self.assertEqual(peaks[:3], [1, 1, 1])
+        for peak in peaks[3:]:
+            self.assertGreater(peak, 1)
+
+    def test_FileMonitor_shared_scan(self):
+        shared_scan = generic.scan.shared_scan
+        generic.scan.shared_scan = generic.scan.SharedScan()
+        # the window of wall-clock time, monitors may be due at any second of it
+        tick = [0]
+        generic.scan.shared_scan.current_tick = lambda: tick[0]
+        try:
+            targets = []
+            listed = []
+            for pattern in ("root/**", "root/f3/**"):
+                golden = monitors.FileMonitor("@hourly", pattern).get_status()
+                file_monitor = monitors.FileMonitor("@hourly", pattern, shared=True)
+                self.assertEqual(file_monitor.get_status(), golden)
+                targets.append(file_monitor.targets)
+                listed.append(generic.scan.shared_scan.misses["listdir"])
+
+            # targets of the subtree were all scanned by the first monitor
+            self.assertEqual(generic.scan.shared_scan.misses["gather"], len(targets[0]))
+            self.assertEqual(generic.scan.shared_scan.hits["gather"], len(targets[1]))
+            # and the directories were all listed by it while expanding "**"
+            self.assertEqual(listed[0], listed[1])
+            self.assertTrue(generic.scan.shared_scan.hits["listdir"])
+
+            # the next window scans again
+            tick[0] += 1
+            file_monitor.get_status()
+            self.assertEqual(generic.scan.shared_scan.hits["gather"], len(targets[1]))
+        finally:
+            generic.scan.shared_scan = shared_scan
+
+    def test_FileMonitor_caches_targets(self):
+        racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # trust mtimes of the fresh tree
+        try:
+            file_monitor = monitors.FileMonitor("@hourly", "root/**")
+            file_monitor.initialize()
+            expansion = file_monitor.expansion
+            targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+            self.assertIs(file_monitor.expansion, expansion)
+
+            sleep(0.1)
+            edit(targets[0])
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.MODIFIED, [targets[0]])]
+            )
+            self.assertIs(file_monitor.expansion, expansion)
+
+            pathname = os.path.join(os.path.dirname(targets[0]), "expansion.add_file")
+            touch(pathname)
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.ADDED, [pathname])]
+            )
+            self.assertIsNot(file_monitor.expansion, expansion)
+            os.remove(pathname)
+        finally:
+            generic.scan.RACY_WINDOW = racy_window
+
+    def test_FileMonitor_resumes_from_snapshot(self):
+        state_dir = tempfile.mkdtemp()
+        try:
+            file_monitor = monitors.FileMonitor(
+                "@hourly", "root/**", name="resume", state_dir=state_dir
+            )
+            file_monitor.initialize()
+            self.assertTrue(os.path.exists(file_monitor.state_file))
+            targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+
+            # changes while gman is down
+            sleep(0.1)
+            touch(targets[0])
+            pathname = os.path.join(os.path.dirname(targets[0]), "resume.add_file")
+            touch(pathname)
+
+            file_monitor = monitors.FileMonitor(
+                "@hourly", "root/**", name="resume", state_dir=state_dir
+            )
+            file_monitor.initialize()
+            self.assertEqual(
+                file_monitor.diff(verbose=False),
+                [(monitors.ADDED, [pathname]), (monitors.MODIFIED, [targets[0]])],
+            )
+            os.remove(pathname)
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    def test_FileMonitor_state_is_committed_eagerly(self):
+        state_dir = tempfile.mkdtemp()
+        try:
+            file_monitor = monitors.FileMonitor(
+                "@hourly", "root/**", name="RLxxxx/eager", state_dir=state_dir
+            )
+            file_monitor.initialize()
+            other = monitors.FileMonitor(
+                "@hourly", "root/**", name="RLxxxx.eager", state_dir=state_dir
+            )
+            self.assertNotEqual(file_monitor.state_file, other.state_file)
+
+            targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+            sleep(0.1)
+            touch(targets[0])
+            # the caller stops reading before the end
+            next(file_monitor.iter_changes())
+            self.assertEqual(file_monitor.diff(verbose=False), [])
+
+            file_monitor = monitors.FileMonitor(
+                "@hourly", "root/**", name="RLxxxx/eager", state_dir=state_dir
+            )
+            file_monitor.initialize()
+            self.assertEqual(file_monitor.diff(verbose=False), [])
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    def test_FileMonitor_detect_content(self):
+        state_dir = tempfile.mkdtemp()
+        try:
+            file_monitor = monitors.FileMonitor(
+                "@hourly",
+                "root/**",
+                name="content",
+                detect="content",
+                state_dir=state_dir,
+            )
+            file_monitor.initialize()
+            self.assertTrue(os.path.exists(file_monitor.hashes_file))
+            targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+
+            # a new mtime with the same content is not a modification
+            sleep(0.1)
+            os.utime(targets[0], None)
+            self.assertEqual(file_monitor.diff(verbose=False), [])
+
+            edit(targets[1])
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.MODIFIED, [targets[1]])]
+            )
+
+            # an unreadable file keeps its digest instead of being reported
+            hash_file = generic.hashcache.hash_file
+
+            def unreadable(pathname):
+                raise IOError(errno.EACCES, os.strerror(errno.EACCES), pathname)
+
+            sleep(0.1)
+            os.utime(targets[2], None)
+            generic.hashcache.hash_file = unreadable
+            try:
+                self.assertEqual(file_monitor.diff(verbose=False), [])
+            finally:
+                generic.hashcache.hash_file = hash_file
+            self.assertEqual(file_monitor.diff(verbose=False), [])
+
+            # so does a new file which was never read
+            pathname = os.path.join(os.path.dirname(targets[0]), "content.add_file")
+            touch(pathname)
+            generic.hashcache.hash_file = unreadable
+            try:
+                self.assertEqual(
+                    file_monitor.diff(verbose=False), [(monitors.ADDED, [pathname])]
+                )
+            finally:
+                generic.hashcache.hash_file = hash_file
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.MODIFIED, [pathname])]
+            )
+            os.remove(pathname)
+            self.assertEqual(
+                file_monitor.diff(verbose=False), [(monitors.REMOVED, [pathname])]
+            )
+
+            # unchanged files are not hashed again after a restart
+            hashed = []
+            generic.hashcache.hash_file = lambda pathname: hashed.append(pathname)
+            try:
+                file_monitor = monitors.FileMonitor(
+                    "@hourly",
+                    "root/**",
+                    name="content",
+                    detect="content",
+                    state_dir=state_dir,
+                )
+                file_monitor.initialize()
+                self.assertEqual(file_monitor.diff(verbose=False), [])
+            finally:
+                generic.hashcache.hash_file = hash_file
+            self.assertEqual(hashed, [])
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is linux only")
+    def test_FileMonitor_with_inotify(self):
+        file_monitor = monitors.FileMonitor("@hourly", "root/**", backend="inotify")
+        file_monitor.initialize()
+        self.assertEqual(file_monitor.backend, "inotify")
+        self.assertEqual(file_monitor.diff(verbose=False), [])
+
+        targets = [f for f in file_monitor.targets if os.path.isfile(f)]
+        golden = defaultdict(list)
+        for pathname in random.sample(targets, 5):
+            touch(pathname)
+            golden[monitors.MODIFIED].append(pathname)
+        sleep(0.1)  # add delay to avoid race condition
+        events = file_monitor.diff(verbose=False)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sorted(events[0][1]), sorted(golden[monitors.MODIFIED]))
+
+        # files are added and removed without a rescan
+        rescans = []
+        rescan = file_monitor.rescan
+        file_monitor.rescan = lambda: rescans.append(1) or rescan()
+        pathname = os.path.join(os.path.dirname(targets[0]), "inotify.add_file")
+        touch(pathname)
+        sleep(0.1)
+        self.assertEqual(
+            file_monitor.diff(verbose=False), [(monitors.ADDED, [pathname])]
+        )
+        os.remove(pathname)
+        sleep(0.1)
+        self.assertEqual(
+            file_monitor.diff(verbose=False), [(monitors.REMOVED, [pathname])]
+        )
+        self.assertEqual(rescans, [])
+
+        # a new directory is watched by a rescan
+        dirname = os.path.join(os.path.dirname(targets[0]), "inotify_dir")
+        os.mkdir(dirname)
+        sleep(0.1)
+        self.assertEqual(file_monitor.diff(verbose=False), [])
+        self.assertEqual(rescans, [1])
+        pathname = os.path.join(dirname, "inotify.add_file")
+        touch(pathname)
+        sleep(0.1)
+        self.assertEqual(
+            file_monitor.diff(verbose=False), [(monitors.ADDED, [pathname])]
+        )
+        self.assertEqual(rescans, [1])
+        os.remove(pathname)
+        os.rmdir(dirname)
+        file_monitor.kill()
+
+    def test_FileMonitor_inotify_falls_back_to_polling(self):
+        def add_watch(self, pathname, mask=None):
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+        file_monitor = monitors.FileMonitor("@hourly", "root/*", backend="inotify")
+        original = generic.inotify.Inotify.add_watch
+        generic.inotify.Inotify.add_watch = add_watch
+        try:
+            file_monitor.initialize()
+        finally:
+            generic.inotify.Inotify.add_watch = original
+        self.assertEqual(file_monitor.backend, "poll")
+        self.assertEqual(file_monitor.before, file_monitor.poll_status())
+
 
 class TestSvnMonitor(unittest.TestCase):
     @classmethod
@@ -225,5 +618,456 @@ class TestSvnMonitor(unittest.TestCase):
                 self.assertEqual(len(events), len(golden))
 
 
+class FakeSvn(object):
+    """
+    answer the svn commands of a SvnMonitor from revisions, and record them
+    """
+
+    def __init__(self, revisions, heads):
+        # normalized pathname -> revision in the working copy
+        self.revisions = revisions
+        self.heads = heads  # normalized pathname -> revision at the repository head
+        self.repository = "file:///repo"  # url of the root, changed by svn switch
+        self.commands = []
+
+    def __call__(self, command, wd=None, log=None, **kwargs):
+        self.commands.append(command)
+        # targets of the tests are absolute pathnames or urls
+        targets = [arg for arg in command[2:] if arg[0] == "/" or "://" in arg]
+        if command[1] == "st":
+            xml = self.status_xml(targets, "infinity" in command)
+        elif command[1] == "info":
+            xml = self.info_xml(targets, "HEAD" in command)
+        else:
+            if command[1] == "up":
+                for target in targets:
+                    path = os.path.normpath(target)
+                    for pathname in self.heads:
+                        if pathname == path or pathname.startswith(path + "/"):
+                            self.revisions[pathname] = self.heads[pathname]
+            xml = " ".join(command)
+        if log is not None:
+            log.write(xml.encode("utf-8"))
+            xml = ""
+        return io.BytesIO(xml.encode("utf-8"))
+
+    def count(self, subcommand):
+        return len([command for command in self.commands if command[1] == subcommand])
+
+    def status_xml(self, targets, infinity=False):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<status>"]
+        for target in targets:
+            path = os.path.normpath(target)
+            lines.append('<target path="%s">' % path)
+            paths = [path]
+            if infinity:
+                paths.extend(
+                    p for p in sorted(self.revisions) if p.startswith(path + "/")
+                )
+            for path in paths:
+                revision = self.revisions.get(path)
+                if revision is None:
+                    lines.append(
+                        '<entry path="%s"><wc-status item="unversioned" props="none" />'
+                        "</entry>" % path
+                    )
+                else:
+                    lines.append(
+                        '<entry path="%s">'
+                        '<wc-status item="normal" props="none" revision="%s">'
+                        '<commit revision="%s"><author>user</author></commit>'
+                        "</wc-status></entry>" % (path, revision, revision)
+                    )
+            lines.append("</target>")
+        lines.append("</status>")
+        return "\n".join(lines)
+
+    def info_xml(self, targets, head):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<info>"]
+        for target in targets:
+            if head:
+                # strip the root, urls of working copies not switched yet keep theirs
+                path = target[target.index("/", len("file:///")) :]
+                revision = self.heads[path]
+            else:
+                path = os.path.normpath(target)
+                revision = self.revisions[path]
+            lines.append(
+                '<entry kind="file" path="%s" revision="%s"><url>%s%s</url>'
+                "<repository><root>%s</root></repository>"
+                '<commit revision="%s"><author>user</author></commit></entry>'
+                % (
+                    os.path.basename(path) if head else path,
+                    revision,
+                    self.repository,
+                    path,
+                    self.repository,
+                    revision,
+                )
+            )
+        lines.append("</info>")
+        return "\n".join(lines)
+
+
+class TestSvnMonitorWithFixtures(unittest.TestCase):
+    def setUp(self):
+        self.racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # trust mtimes of the fresh working copies
+        self.dirname = tempfile.mkdtemp()
+        self.revisions = {os.path.join(self.dirname, "wc2"): 1}
+        for wc, names in (("wc1", ["a.v", "b.v", "c.v"]), ("wc2", ["d.v"])):
+            os.makedirs(os.path.join(self.dirname, wc, ".svn"))
+            touch(os.path.join(self.dirname, wc, ".svn", "wc.db"))
+            for name in names:
+                pathname = os.path.join(self.dirname, wc, name)
+                touch(pathname)
+                if name != "c.v":
+                    self.revisions[pathname] = 1
+
+    def tearDown(self):
+        generic.scan.RACY_WINDOW = self.racy_window
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def create_monitor(self):
+        svn = monitors.SvnMonitor(
+            "@hourly",
+            [
+                os.path.join(self.dirname, "wc1", "*.v"),
+                os.path.join(self.dirname, "wc2/"),
+            ],
+        )
+        svn.open_command = FakeSvn(self.revisions, dict(self.revisions))
+        return svn
+
+    def test_batched_status(self):
+        svn = self.create_monitor()
+        self.assertEqual(
+            sorted(svn.targets),
+            [os.path.join(self.dirname, "wc1", name) for name in ("a.v", "b.v")]
+            + [os.path.join(self.dirname, "wc2/")],
+        )
+        # one svn st per working copy to check targets are versioned
+        self.assertEqual(svn.open_command.count("st"), 2)
+
+        # and one per working copy to collect the status
+        svn.initialize()
+        self.assertEqual(len(svn.before), 3)
+        self.assertEqual(svn.open_command.count("st"), 4)
+
+        # a commit in the working copy is a modification too
+        pathname = os.path.join(self.dirname, "wc1", "b.v")
+        self.revisions[pathname] = 2
+        self.assertEqual(svn.diff(verbose=False), [(monitors.MODIFIED, [pathname])])
+        self.assertEqual(svn.open_command.count("st"), 6)
+
+    def test_versioned_targets_are_cached(self):
+        # wc.db was modified long enough ago for its key to be trusted
+        wc_db = os.path.join(self.dirname, "wc1", ".svn", "wc.db")
+        mtime = time.time() - 100
+        os.utime(wc_db, (mtime, mtime))
+        svn = self.create_monitor()
+        self.assertEqual(len(svn.targets), 3)
+        self.assertEqual(svn.open_command.count("st"), 2)
+        self.assertIsNotNone(svn.versioned[os.path.join(self.dirname, "wc1", "a.v")][0])
+
+        # a new file in the directory expands targets again, with the same wc.db
+        touch(os.path.join(self.dirname, "wc1", "x.txt"))
+        self.assertEqual(len(svn.targets), 3)
+        self.assertEqual(svn.open_command.count("st"), 2)
+
+        # svn add or delete modifies wc.db, targets of its working copy are checked again
+        os.utime(wc_db, (mtime + 50, mtime + 50))
+        self.assertEqual(len(svn.targets), 3)
+        self.assertEqual(svn.open_command.count("st"), 3)
+
+    def test_checkout_is_found(self):
+        svn = self.create_monitor()
+        dirname = os.path.join(self.dirname, "wc3")
+        os.makedirs(dirname)
+        self.assertIsNone(svn.find_wc_db(dirname))
+
+        os.makedirs(os.path.join(dirname, ".svn"))
+        touch(os.path.join(dirname, ".svn", "wc.db"))
+        self.assertEqual(
+            svn.find_wc_db(dirname), os.path.join(dirname, ".svn", "wc.db")
+        )
+
+    def test_update_only_behind_targets(self):
+        svn = self.create_monitor()
+        svn.initialize()
+        self.assertEqual(svn.diff(verbose=False), [])
+        # urls of targets are looked up once, the heads are probed by one svn info
+        self.assertEqual(svn.open_command.count("info"), 2)
+        self.assertEqual(svn.open_command.count("up"), 0)
+
+        pathname = os.path.join(self.dirname, "wc1", "b.v")
+        svn.open_command.heads[pathname] = 2
+        self.assertEqual(svn.diff(verbose=False), [(monitors.MODIFIED, [pathname])])
+        self.assertEqual(svn.open_command.count("info"), 3)
+        updates = [
+            command for command in svn.open_command.commands if command[1] == "up"
+        ]
+        self.assertEqual(updates, [["svn", "up", pathname, "--quiet"]])
+
+    def test_switched_targets_are_looked_up_again(self):
+        svn = self.create_monitor()
+        svn.initialize()
+        self.assertEqual(svn.diff(verbose=False), [])
+        self.assertEqual(svn.open_command.count("info"), 2)
+
+        # svn switch modifies wc.db
+        svn.open_command.repository = "file:///branch"
+        wc_db = os.path.join(self.dirname, "wc1", ".svn", "wc.db")
+        os.utime(wc_db, (time.time() - 10, time.time() - 10))
+        start = len(svn.open_command.commands)
+        self.assertEqual(svn.diff(verbose=False), [])
+        urls = [
+            arg
+            for command in svn.open_command.commands[start:]
+            if command[1] == "info" and "HEAD" in command
+            for arg in command
+            if arg.startswith("file:///")
+        ]
+        wc1 = os.path.join(self.dirname, "wc1")
+        self.assertEqual(
+            sorted(url for url in urls if wc1 in url),
+            ["file:///branch" + os.path.join(wc1, name) for name in ("a.v", "b.v")],
+        )
+
+    def test_logs_are_fetched_in_background(self):
+        svn = self.create_monitor()
+        svn.initialize()
+        self.assertEqual(svn.diff(verbose=False), [])
+
+        pathnames = [os.path.join(self.dirname, "wc1", name) for name in ("a.v", "b.v")]
+        for pathname in pathnames:
+            svn.open_command.heads[pathname] = 3
+        with self.assertLogs(svn.logger, "INFO") as captured:
+            self.assertEqual(svn.diff(), [(monitors.MODIFIED, pathnames)])
+
+        # both files share the log of the repository for r2:3
+        logs = set(line.rsplit(" = ", 1)[1] for line in captured.output)
+        self.assertEqual(len(logs), 1)
+        log = logs.pop()
+        for _ in range(100):
+            if os.path.getsize(log):
+                break
+            sleep(0.01)
+        # of the paths of the files rather than of the whole repository
+        paths = [pathname.lstrip("/") for pathname in pathnames]
+        logs = [command for command in svn.open_command.commands if command[1] == "log"]
+        self.assertEqual(
+            logs,
+            [
+                ["svn", "log", "file:///repo"]
+                + paths
+                + ["--revision", "2:3", "--verbose"]
+            ],
+        )
+        with open(log) as fo:
+            self.assertEqual(fo.read(), " ".join(logs[0]))
+        os.remove(log)
+
+    def test_logs_are_fetched_in_background_without_pool(self):
+        svn = self.create_monitor()
+        svn.initialize()
+        self.assertEqual(svn.diff(verbose=False), [])
+
+        threads = []
+        done = threading.Event()
+
+        def write_log(log, *args):
+            threads.append(threading.current_thread())
+            os.remove(log)
+            done.set()
+
+        svn.write_log = write_log
+        module = sys.modules["monitors.SvnMonitor"]
+        get_executor = module.get_executor
+        module.get_executor = lambda: None
+        try:
+            pathname = os.path.join(self.dirname, "wc1", "a.v")
+            svn.open_command.heads[pathname] = 3
+            svn.diff()
+        finally:
+            module.get_executor = get_executor
+        self.assertTrue(done.wait(5))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_depth_infinity(self):
+        wc2 = os.path.join(self.dirname, "wc2")
+        svn = monitors.SvnMonitor("@hourly", wc2, depth="infinity")
+        svn.open_command = FakeSvn(self.revisions, dict(self.revisions))
+        svn.initialize()
+        pathname = os.path.join(wc2, "d.v")
+        self.assertEqual(dict(svn.before.items()), {wc2: 1, pathname: 1})
+
+        svn.open_command.heads[wc2] = svn.open_command.heads[pathname] = 3
+        self.assertEqual(
+            svn.diff(verbose=False), [(monitors.MODIFIED, sorted([wc2, pathname]))]
+        )
+
+        # a directory committed under the target is reported, and logged, as added
+        subdir = os.path.join(wc2, "sub")
+        os.mkdir(subdir)
+        svn.open_command.heads[wc2] = svn.open_command.heads[subdir] = 4
+        tempdir = tempfile.tempdir
+        tempfile.tempdir = self.dirname  # the log of wc2
+        try:
+            with self.assertLogs(svn.logger, "INFO") as captured:
+                self.assertEqual(
+                    svn.diff(), [(monitors.ADDED, [subdir]), (monitors.MODIFIED, [wc2])]
+                )
+        finally:
+            tempfile.tempdir = tempdir
+        self.assertIn("INFO:root:r4 | added %s" % subdir, captured.output)
+        self.assertRaises(
+            ValueError, monitors.SvnMonitor, "@hourly", wc2, depth="unknown"
+        )
+
+    def test_output_is_streamed(self):
+        svn = monitors.SvnMonitor("@hourly", os.path.join(self.dirname, "wc2"))
+        # more stderr than a pipe can hold, svn must not block on it
+        script = (
+            "import sys\n"
+            "sys.stderr.write('x' * 1000000)\n"
+            "print('<status>%s</status>' % ('<entry path=\"p\" />' * 10000))\n"
+            "sys.exit(1)\n"
+        )
+        # no temporary file is written, in a private tempdir nothing else writes to
+        tempdir = tempfile.tempdir
+        tempfile.tempdir = tempfile.mkdtemp(dir=self.dirname)
+        try:
+            with svn.open_command([sys.executable, "-c", script]) as stdout:
+                entries = list(iter_elements(stdout))
+            self.assertEqual(os.listdir(tempfile.tempdir), [])
+        finally:
+            tempfile.tempdir = tempdir
+        self.assertEqual(len(entries), 10000)
+        self.assertEqual(svn.workers, set())
+
+
+class TestGitMonitor(unittest.TestCase):
+    def setUp(self):
+        self.racy_window = generic.scan.RACY_WINDOW
+        generic.scan.RACY_WINDOW = -1  # trust mtimes of the fresh repository
+        self.dirname = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self.dirname, "repo", ".git")
+        os.makedirs(os.path.join(self.git_dir, "refs", "heads", "feature"))
+        os.makedirs(os.path.join(self.git_dir, "refs", "tags"))
+        self.write("HEAD", "ref: refs/heads/master")
+        self.write("refs/heads/master", "1" * 40)
+        self.write("refs/heads/feature/x", "2" * 40)
+        self.write(
+            "packed-refs",
+            "# pack-refs with: peeled fully-peeled sorted\n"
+            "%s refs/heads/master\n%s refs/tags/v1\n^%s\n"
+            % ("0" * 40, "3" * 40, "4" * 40),
+        )
+
+    def tearDown(self):
+        generic.scan.RACY_WINDOW = self.racy_window
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def write(self, refname, content):
+        # git writes a new file and renames it into place
+        pathname = os.path.join(self.git_dir, refname)
+        with open(pathname + ".lock", "w") as fo:
+            fo.write(content + "\n")
+        os.rename(pathname + ".lock", pathname)
+
+    def test_refs(self):
+        git = monitors.GitMonitor("@hourly", os.path.join(self.dirname, "*"))
+        git.initialize()
+        refs = dict(
+            (os.path.relpath(pathname, self.git_dir), int_to_sha(commit))
+            for pathname, commit in git.before.items()
+        )
+        self.assertEqual(
+            refs,
+            {
+                "HEAD": "1" * 16,
+                "refs/heads/master": "1" * 16,
+                "refs/heads/feature/x": "2" * 16,
+                "refs/tags/v1": "3" * 16,
+            },
+        )
+
+        self.write("refs/heads/feature/x", "5" * 40)
+        self.write("refs/heads/feature/y", "6" * 40)
+        os.remove(os.path.join(self.git_dir, "refs", "heads", "master"))
+        feature = os.path.join(self.git_dir, "refs", "heads", "feature")
+        self.assertEqual(
+            git.diff(verbose=False),
+            [
+                (monitors.ADDED, [os.path.join(feature, "y")]),
+                (
+                    monitors.MODIFIED,
+                    [
+                        os.path.join(self.git_dir, "HEAD"),
+                        os.path.join(feature, "x"),
+                        os.path.join(self.git_dir, "refs", "heads", "master"),
+                    ],
+                ),
+            ],
+        )
+
+        # HEAD moves to another branch
+        self.write("HEAD", "ref: refs/heads/feature/y")
+        self.assertEqual(
+            git.diff(verbose=False),
+            [(monitors.MODIFIED, [os.path.join(self.git_dir, "HEAD")])],
+        )
+        self.assertEqual(git.diff(verbose=False), [])
+
+    def test_refs_pattern(self):
+        git = monitors.GitMonitor(
+            "@hourly", os.path.join(self.dirname, "repo"), refs=["refs/tags/*"]
+        )
+        self.assertEqual(
+            list(git.get_status().keys()),
+            [os.path.join(self.git_dir, "refs", "tags", "v1")],
+        )
+
+    def test_fetch_in_background(self):
+        release = threading.Event()
+        commands = []
+
+        class FakeFetch(object):
+            def __init__(self, command, **kwargs):
+                commands.append(command)
+                self.returncode = None
+
+            def communicate(self):
+                release.wait(5)
+                self.returncode = 1
+                return b"fatal: unable to access remote", None
+
+        class FakeSubprocess(object):
+            PIPE = subprocess.PIPE
+            STDOUT = subprocess.STDOUT
+            Popen = FakeFetch
+
+        module = sys.modules["monitors.GitMonitor"]
+        module.subprocess = FakeSubprocess
+        try:
+            git = monitors.GitMonitor(
+                "@hourly", os.path.join(self.dirname, "repo"), fetch=True
+            )
+            with self.assertLogs(git.logger, "ERROR") as captured:
+                # refs are read while the fetch is running, which isn't run twice
+                git.initialize()
+                self.assertEqual(git.diff(verbose=False), [])
+                release.set()
+                for _ in range(100):
+                    if captured.output:
+                        break
+                    sleep(0.01)
+        finally:
+            module.subprocess = subprocess
+        self.assertEqual(len(commands), 1)
+        self.assertIn("fatal: unable to access remote", captured.output[0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,191 @@
+import unittest
+import datetime
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+# local packages
+import runtime
+import monitors
+from event import ANY_EVENT
+
+
+class FakeEventManager(object):
+    is_done = True
+
+
+class FakeMonitor(object):
+    def __init__(self, interval):
+        self.interval = datetime.timedelta(seconds=interval)
+        self.event_manager = FakeEventManager()
+        self.next_run = None
+        self.calls = 0
+
+    def initialize(self):
+        self.next_run = runtime.loop.get_time() + self.interval
+
+    def __call__(self):
+        self.calls += 1
+        self.next_run = runtime.loop.get_time() + self.interval
+
+    def kill(self):
+        pass
+
+
+class SlowMonitor(FakeMonitor):
+    """
+    a monitor which takes 0.5 second to collect its events
+    """
+
+    is_due = True
+
+    def schedule_next_run(self):
+        self.next_run = runtime.loop.get_time() + self.interval
+
+    def collect_events(self):
+        time.sleep(0.5)
+        return ["event"]
+
+    def dispatch(self, events):
+        self.calls += 1
+
+
+class TestEventLoop(unittest.TestCase):
+    def test_only_due_monitors_are_woken(self):
+        fast = FakeMonitor(0.2)
+        slow = [FakeMonitor(60) for _ in range(200)]
+        loop = runtime.EventLoop([fast] + slow)
+        loop.initialize()
+        start = runtime.loop.get_time()
+        for _ in range(5):
+            loop.run_once()
+        elapsed = (runtime.loop.get_time() - start).total_seconds()
+
+        self.assertEqual(fast.calls, 5)
+        self.assertTrue(all(monitor.calls == 0 for monitor in slow))
+        self.assertLess(elapsed, 2)
+
+    def test_busy_monitor_is_polled(self):
+        busy = FakeMonitor(60)
+        busy.event_manager.is_done = False
+        loop = runtime.EventLoop([busy], poll_interval=0.1)
+        loop.initialize()
+        loop.run_once()
+        self.assertEqual(busy.calls, 1)
+
+    def test_collect_events_concurrently(self):
+        slow = [SlowMonitor(0.1) for _ in range(8)]
+        loop = runtime.EventLoop(slow, threads=8)
+        loop.initialize()
+        start = runtime.loop.get_time()
+        while not all(monitor.calls for monitor in slow):
+            loop.run_once()
+        elapsed = (runtime.loop.get_time() - start).total_seconds()
+        loop.kill()
+        self.assertLess(elapsed, 2)
+
+
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_shard_of(self):
+        names = ["RLxxxx/job_%s" % i for i in range(1000)]
+        shards = [runtime.shard_of(name, 4) for name in names]
+        self.assertEqual(shards, [runtime.shard_of(name, 4) for name in names])
+        for shard in range(4):
+            self.assertGreater(shards.count(shard), 150)
+
+    def test_crashed_worker_is_restarted(self):
+        tempdir = self.tempdir
+
+        def worker(shard, workers):
+            marker = os.path.join(tempdir, str(shard))
+            if shard == 0 and not os.path.exists(marker):
+                open(marker, "w").close()
+                raise SystemExit(1)
+
+        supervisor = runtime.Supervisor(worker, 2, restart_delay=0)
+        supervisor.start()
+        supervisor.run_forever(interval=0.1)
+        self.assertEqual(supervisor.restarts, 1)
+        self.assertEqual(supervisor.processes, {})
+
+
+class TestKeyedExecutor(unittest.TestCase):
+    def test_limits(self):
+        from runtime.pool import KeyedExecutor
+
+        lock = threading.Lock()
+        running = {"total": 0}
+        peaks = {}
+
+        def job(key):
+            with lock:
+                running["total"] += 1
+                running[key] = running.get(key, 0) + 1
+                peaks["total"] = max(peaks.get("total", 0), running["total"])
+                peaks[key] = max(peaks.get(key, 0), running[key])
+            time.sleep(0.05)
+            with lock:
+                running["total"] -= 1
+                running[key] -= 1
+            return key
+
+        executor = KeyedExecutor(threads=4, per_key=2)
+        keys = ["repo_%s" % (i % 3) for i in range(12)]
+        start = time.time()
+        futures = [executor.submit(key, job, key) for key in keys]
+        self.assertEqual([future.result() for future in futures], keys)
+        elapsed = time.time() - start
+        executor.shutdown()
+
+        self.assertEqual(peaks["total"], 4)
+        for key in set(keys):
+            self.assertLessEqual(peaks[key], 2)
+        # 12 jobs on 4 threads take 3 rounds rather than 12
+        self.assertLess(elapsed, 0.5)
+
+
+class TestLazyPool(unittest.TestCase):
+    def test_pool_per_process(self):
+        from runtime.pool import LazyPool
+
+        pools = LazyPool(object)
+        pool = pools.get()
+        self.assertIs(pools.get(), pool)
+        # a forked process creates its own pool
+        pools.pid = -1
+        self.assertIsNot(pools.get(), pool)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio runtime requires python 3.5+")
+class TestAsyncEventLoop(unittest.TestCase):
+    def test_callbacks_are_awaited(self):
+        from runtime.aio import AsyncEventLoop
+
+        scheduler = monitors.Scheduler("every 1 seconds", name="aio")
+        scheduler.add_event(
+            ANY_EVENT,
+            [dict(name="first", cmd="true"), dict(name="second", cmd="true")],
+            dict(env={}),
+        )
+        loop = AsyncEventLoop([scheduler])
+        loop.initialize()
+        timer = threading.Timer(2.5, lambda: loop.loop.call_soon_threadsafe(loop.stop))
+        timer.start()
+        loop.run_forever()
+        callbacks = list(scheduler.event_manager.iter_callbacks())
+        self.assertTrue(all(callback.is_done for callback in callbacks))
+        self.assertTrue(all(callback.returncode == 0 for callback in callbacks))
+        self.assertTrue(all(callback.worker is not None for callback in callbacks))
+
+
+if __name__ == "__main__":
+    unittest.main()